@@ -8,7 +8,8 @@ from django.contrib import admin
 from django.shortcuts import render, redirect
 from django.urls import path, reverse
 from django.contrib import messages
-from django.db.models import Avg
+from django.db.models import Avg, Count
+from django.forms.models import BaseInlineFormSet
 from django.utils.html import format_html
 from django.core.files.storage import default_storage
 from pathlib import Path
@@ -20,7 +21,8 @@ import re
 
 from .models import (
     TestCategory, QuestionTopic, Question, Test, TestAttempt, Answer, UserProfile,
-    Cohort, CohortMembership, ProctoringEvent, PlagiarismFlag, TestTopicDistribution
+    Cohort, CohortMembership, ProctoringEvent, PlagiarismFlag, TestTopicDistribution,
+    TestStats
 )
 
 @admin.register(UserProfile)
@@ -695,9 +697,16 @@ class CohortAdmin(admin.ModelAdmin):
     list_editable = ['is_active']
     change_list_template = 'admin/cohort_changelist.html'
     
+    def get_queryset(self, request):
+        # Categories and member counts for every listed cohort in two queries
+        return super().get_queryset(request).prefetch_related(
+            'enabled_categories'
+        ).annotate(member_total=Count('members'))
+    
     def member_count(self, obj):
-        return obj.members.count()
+        return obj.member_total
     member_count.short_description = 'Members'
+    member_count.admin_order_field = 'member_total'
     
     def enabled_categories_list(self, obj):
         categories = obj.enabled_categories.all()
@@ -812,11 +821,28 @@ class CohortMembershipAdmin(admin.ModelAdmin):
     bulk_remove_from_cohort.short_description = 'Remove selected users from cohorts'
 
 
+class TestTopicDistributionFormSet(BaseInlineFormSet):
+    def full_clean(self):
+        """Count available questions for every submitted topic in one query"""
+        if self.is_bound:
+            topic_ids = set()
+            for form in self.forms:
+                try:
+                    topic_ids.add(int(form['topic'].data))
+                except (TypeError, ValueError):
+                    continue
+            counts = TestTopicDistribution.available_question_counts(topic_ids)
+            for form in self.forms:
+                form.instance._available_counts = counts
+        super().full_clean()
+
+
 class TestTopicDistributionInline(admin.TabularInline):
     """
     Inline admin for configuring question distribution across topics.
     """
     model = TestTopicDistribution
+    formset = TestTopicDistributionFormSet
     extra = 1
     fields = ['topic', 'num_questions', 'order']
     verbose_name = 'Topic Distribution'
@@ -834,7 +860,7 @@ class TestTopicDistributionInline(admin.TabularInline):
 @admin.register(Test)
 class TestAdmin(admin.ModelAdmin):
     list_display = ['title', 'category', 'time_limit_minutes', 'passing_score', 
-                    'total_questions', 'attempt_count', 'is_active']
+                    'total_questions', 'attempt_count', 'pass_rate', 'is_active']
     list_filter = ['is_active', 'category', 'require_webcam', 'require_fullscreen']
     search_fields = ['title', 'description']
     filter_horizontal = ['manual_questions']
@@ -847,10 +873,27 @@ class TestAdmin(admin.ModelAdmin):
         return obj.get_total_questions()
     total_questions.short_description = 'Questions'
     
+    def get_queryset(self, request):
+        # Attempt and pass counts come from the TestStats view in the same query
+        return super().get_queryset(request).select_related('stats')
+    
+    def _stats(self, obj):
+        try:
+            return obj.stats
+        except TestStats.DoesNotExist:
+            # No attempts yet
+            return None
+    
     def attempt_count(self, obj):
-        return obj.attempts.count()
+        stats = self._stats(obj)
+        return stats.total if stats else 0
     attempt_count.short_description = 'Attempts'
     
+    def pass_rate(self, obj):
+        stats = self._stats(obj)
+        return f"{stats.pass_rate:.1f}%" if stats else '-'
+    pass_rate.short_description = 'Pass Rate'
+    
     fieldsets = (
         ('Test Information', {
             'fields': ('category', 'title', 'description')
@@ -870,6 +913,7 @@ class TestAdmin(admin.ModelAdmin):
 class AnswerInline(admin.TabularInline):
     model = Answer
     extra = 0
+    ordering = ['answered_at']
     readonly_fields = ['question', 'selected_answer', 'is_correct', 'time_spent_seconds', 'answered_at']
     can_delete = False
     
@@ -887,6 +931,9 @@ class TestAttemptAdmin(admin.ModelAdmin):
                        'ip_address', 'user_agent', 'similarity_score']
     inlines = [AnswerInline]
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_display()
+    
     def consent_status(self, obj):
         """Display consent acceptance status"""
         if obj.consent_given:
@@ -1061,6 +1108,7 @@ class ProctoringEventAdmin(admin.ModelAdmin):
         'has_image',
         'view_details'
     ]
+    list_select_related = ['attempt__user']
     list_filter = [
         'severity',
         'event_type',
@@ -1085,6 +1133,7 @@ class ProctoringEventAdmin(admin.ModelAdmin):
         'image_preview',
     ]
     date_hierarchy = 'timestamp'
+    ordering = ['-timestamp']
     
     def severity_icon(self, obj):
         """Display colored icon based on severity"""
@@ -1208,6 +1257,8 @@ class ProctoringEventAdmin(admin.ModelAdmin):
 class PlagiarismFlagAdmin(admin.ModelAdmin):
     list_display = ['attempt1_user', 'attempt2_user', 'similarity_percentage', 
                     'reviewed', 'action_taken', 'detected_at']
+    list_select_related = ['attempt1__user', 'attempt2__user']
+    ordering = ['-detected_at']
     list_filter = ['reviewed', 'action_taken', 'detected_at']
     search_fields = ['attempt1__user__username', 'attempt2__user__username']
     readonly_fields = ['attempt1', 'attempt2', 'similarity_percentage', 
@@ -1252,7 +1303,7 @@ def admin_dashboard_view(request):
     flagged_count = TestAttempt.objects.filter(flagged_for_plagiarism=True).count()
     
     # Recent activity
-    recent_attempts = TestAttempt.objects.select_related('user', 'test').order_by('-started_at')[:50]
+    recent_attempts = TestAttempt.objects.with_display().order_by('-started_at')[:50]
     
     context = {
         'total_questions': total_questions,
@@ -57,7 +57,7 @@ def user_analytics_dashboard(request):
     attempts = TestAttempt.objects.filter(
         user=user,
         status='completed'
-    ).select_related('test__category').order_by('-completed_at')
+    ).with_display().order_by('-completed_at')
     
     avg_score_decimal = attempts.aggregate(Avg('score'))['score__avg']
     context = {
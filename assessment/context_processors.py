@@ -13,7 +13,7 @@ def profile_completion(request):
                 profile = request.user.profile
             except UserProfile.DoesNotExist:
                 # Create profile if it doesn't exist
-                profile = UserProfile.objects.create(user=request.user)
+                profile, _ = UserProfile.objects.get_or_create(user=request.user)
             
             # Required fields for profile completion
             required_fields = {
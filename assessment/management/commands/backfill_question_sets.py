@@ -0,0 +1,36 @@
+"""
+Move legacy JSON question sets into TestAttempt.question_set_packed
+"""
+from django.core.management.base import BaseCommand
+
+from assessment.models import TestAttempt
+
+
+class Command(BaseCommand):
+    help = 'Pack question_set JSON into question_set_packed and clear the JSON column'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Attempts updated per query (default: 1000)'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        pending = TestAttempt.objects.filter(
+            question_set_packed__isnull=True, question_set__isnull=False
+        ).order_by('pk')
+
+        total = 0
+        while True:
+            # Updated rows drop out of the filter, so always take the first batch
+            attempts = list(pending.only('id', 'question_set')[:batch_size])
+            if not attempts:
+                break
+            for attempt in attempts:
+                attempt.question_ids = attempt.question_set
+                attempt.question_set = None
+            TestAttempt.objects.bulk_update(attempts, ['question_set_packed', 'question_set'])
+            total += len(attempts)
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled {total} attempt(s)'))
@@ -0,0 +1,36 @@
+"""
+Flag completed attempts that share suspiciously many answers
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from assessment.models import PlagiarismFlag
+
+
+class Command(BaseCommand):
+    help = 'Compare recently completed attempts and create PlagiarismFlag rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=1,
+            help='Compare attempts completed in the last N days against all others (default: 1)'
+        )
+        parser.add_argument(
+            '--min-matches', type=int, default=None,
+            help='Identical answers needed before a pair is scored (default: PLAGIARISM_MIN_MATCHES)'
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=None,
+            help='Similarity percentage that raises a flag (default: PLAGIARISM_SIMILARITY_THRESHOLD)'
+        )
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=options['days'])
+        flagged = PlagiarismFlag.detect(
+            since=since,
+            min_matches=options['min_matches'],
+            threshold=options['threshold'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Created {flagged} plagiarism flag(s)'))
@@ -2,16 +2,109 @@
 Enhanced Assessment Models for MRI Training Platform
 Includes: Categories, Topics, Cohorts, Proctoring, Plagiarism Detection
 """
-from django.db import models
+from django.db import models, connections, router
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.utils import timezone
+from django.core.cache import cache, caches
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.memcached import BaseMemcachedCache
+from django.core.cache.backends.redis import RedisCache
 from django.core.validators import MinValueValidator, MaxValueValidator, RegexValidator, FileExtensionValidator
-from django.db.models import Count, Q
-from django.db.models.signals import post_save
+from django.db.models import Count, Exists, OuterRef, Q, Sum
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_save, post_delete, post_migrate
 from django.dispatch import receiver
+from django.utils.functional import cached_property
 from datetime import timedelta
-import json
+import itertools
+import math
+import numpy as np
 import random
+import struct
+import time
+
+
+# Cached active question IDs per topic (see QuestionTopic.get_active_question_ids)
+QUESTIONS_VERSION_KEY = 'questions_version'
+QUESTION_IDS_CACHE_TIMEOUT = 300  # 5 minutes
+# Backends every worker reads the same data from; the question ID cache is
+# bypassed on anything else (locmem, file-based, dummy)
+SHARED_CACHE_BACKENDS = (RedisCache, BaseMemcachedCache, DatabaseCache)
+# Topics above this size are sampled by streaming instead of caching all IDs
+LARGE_TOPIC_QUESTION_COUNT = 10000
+# Per-row uniform random number in [0, 1) for each backend
+RANDOM_FRACTION_SQL = {
+    'postgresql': 'RANDOM()',
+    'mysql': 'RAND()',
+    'sqlite': '(ABS(RANDOM()) / 9223372036854775808.0)',
+}
+
+# Per-vendor aggregate collecting the matched question IDs of a pair
+QUESTION_ID_LIST_SQL = {
+    'postgresql': "STRING_AGG(a1.question_id::text, ',')",
+    'mysql': 'GROUP_CONCAT(a1.question_id)',
+    'sqlite': 'GROUP_CONCAT(a1.question_id)',
+}
+
+# Required profile fields; bit N of UserProfile.completion_flags tracks field N
+PROFILE_REQUIRED_FIELDS = (
+    'phone_number',
+    'date_of_birth',
+    'national_id',
+    'province',
+    'city',
+    'street_address',
+    'employment_status',
+    'education_level',
+    'terms_accepted',
+    'data_processing_consent',
+    'cv_document',
+)
+PROFILE_COMPLETE_FLAGS = (1 << len(PROFILE_REQUIRED_FIELDS)) - 1
+
+# Decoded Question.hotspot_regions keyed by (pk, updated_at), shared per process
+# Questions with fewer hotspots than this are checked without NumPy; a
+# single-click NumPy check costs ~15us, the tuple loop ~0.05us per region
+HOTSPOT_VECTORIZE_MIN_REGIONS = 256
+HOTSPOT_REGIONS_CACHE_SIZE = 1024
+_HOTSPOT_REGIONS_CACHE = {}
+
+# Rows removed per DELETE by ProctoringEvent.cleanup_old_snapshots()
+CLEANUP_BATCH_SIZE = 10000
+
+# End-of-stream marker for reservoir_sample()
+_EXHAUSTED = object()
+
+
+def reservoir_sample(iterable, k):
+    """
+    Uniformly sample k items from an iterable of unknown length in O(k)
+    memory (Li's Algorithm L, which skips ahead instead of drawing per item)
+    """
+    iterator = iter(iterable)
+    reservoir = list(itertools.islice(iterator, k))
+    if len(reservoir) < k or k == 0:
+        return reservoir
+    
+    # 1 - random() lies in (0, 1], keeping log() defined
+    w = math.exp(math.log(1.0 - random.random()) / k)
+    while True:
+        skip = math.floor(math.log(1.0 - random.random()) / math.log(1.0 - w))
+        item = next(itertools.islice(iterator, skip, None), _EXHAUSTED)
+        if item is _EXHAUSTED:
+            return reservoir
+        reservoir[random.randrange(k)] = item
+        w *= math.exp(math.log(1.0 - random.random()) / k)
+
+
+def question_cache_is_shared():
+    """
+    True if the default cache is shared by all workers. Per-process or
+    per-host caches never see another worker's version bump, and
+    DummyCache stores nothing, so the question ID cache is bypassed on them.
+    """
+    return isinstance(caches['default'], SHARED_CACHE_BACKENDS)
 
 
 class UserProfile(models.Model):
@@ -206,6 +299,11 @@ class UserProfile(models.Model):
         default=False,
         help_text="Has the user completed their profile?"
     )
+    completion_flags = models.PositiveSmallIntegerField(
+        default=0,
+        editable=False,
+        help_text="Bitmask of filled-in required fields (see PROFILE_REQUIRED_FIELDS)"
+    )
     profile_photo = models.ImageField(
         upload_to='profile_photos/',
         null=True,
@@ -238,39 +336,24 @@ class UserProfile(models.Model):
             address_str += f" {self.postal_code}"
         return address_str
     
+    def compute_completion_flags(self):
+        """Bitmask with one bit set per filled-in required field"""
+        flags = 0
+        for bit, name in enumerate(PROFILE_REQUIRED_FIELDS):
+            value = getattr(self, name)
+            if isinstance(value, str):
+                value = value.strip()
+            if value:
+                flags |= 1 << bit
+        return flags
+    
     def is_profile_complete(self):
-        """Check if all required fields are filled"""
-        text_fields = [
-            self.phone_number,
-            self.national_id,
-            self.province,
-            self.city,
-            self.street_address,
-            self.employment_status,
-            self.education_level,
-        ]
-        
-        # Check date field
-        if not self.date_of_birth:
-            return False
-        
-        # Check boolean fields (must be True, not just present)
-        if not self.terms_accepted or not self.data_processing_consent:
-            return False
-        
-        # Check file field
-        if not self.cv_document:
-            return False
-        
-        # Check all text fields are not empty
-        for field in text_fields:
-            if not field or (isinstance(field, str) and field.strip() == ''):
-                return False
-        
-        return True
+        """Check if all required fields are filled (as of the last save)"""
+        return self.completion_flags == PROFILE_COMPLETE_FLAGS
     
     def save(self, *args, **kwargs):
-        """Override save to update profile_completed status"""
+        """Override save to update completion_flags and profile_completed"""
+        self.completion_flags = self.compute_completion_flags()
         self.profile_completed = self.is_profile_complete()
         super().save(*args, **kwargs)
     
@@ -334,23 +417,96 @@ class QuestionTopic(models.Model):
     def __str__(self):
         return f"{self.category.name} - {self.name}"
     
+    @classmethod
+    def get_active_question_ids(cls, topic_ids):
+        """
+        Map each topic ID to the IDs of its active questions.
+        Served from the cache; topics missing from it are loaded in one query.
+        The cache version is bumped whenever a Question is saved or deleted.
+        Without a shared cache backend every call reads the database.
+        """
+        if not question_cache_is_shared():
+            return cls._load_active_question_ids(topic_ids)
+        
+        version = cache.get_or_set(QUESTIONS_VERSION_KEY, time.time_ns, None)
+        keys = {f'qids:{topic_id}:v{version}': topic_id for topic_id in topic_ids}
+        cached = cache.get_many(keys)
+        
+        ids_by_topic = {keys[key]: ids for key, ids in cached.items()}
+        missing = [topic_id for key, topic_id in keys.items() if key not in cached]
+        if missing:
+            loaded = cls._load_active_question_ids(missing)
+            cache.set_many(
+                {f'qids:{topic_id}:v{version}': ids for topic_id, ids in loaded.items()},
+                QUESTION_IDS_CACHE_TIMEOUT
+            )
+            ids_by_topic.update(loaded)
+        
+        return ids_by_topic
+    
+    @staticmethod
+    def _load_active_question_ids(topic_ids):
+        """Active question IDs per topic, read in one query"""
+        loaded = {topic_id: [] for topic_id in topic_ids}
+        for topic_id, question_id in Question.objects.filter(
+            topic_id__in=topic_ids, is_active=True
+        ).order_by().values_list('topic_id', 'id'):
+            loaded[topic_id].append(question_id)
+        return loaded
+    
+    def sample_question_ids(self, count):
+        """
+        Pick up to `count` random active question IDs.
+        Large topics are reservoir-sampled from a streamed query so the
+        full ID list is never held in memory.
+        """
+        question_ids = None
+        if question_cache_is_shared():
+            version = cache.get_or_set(QUESTIONS_VERSION_KEY, time.time_ns, None)
+            question_ids = cache.get(f'qids:{self.id}:v{version}')
+        if question_ids is None:
+            # No default ordering: it would join topic and category
+            active = Question.objects.filter(topic_id=self.id, is_active=True).order_by()
+            total = active.count()
+            if total > LARGE_TOPIC_QUESTION_COUNT:
+                return self._sample_large_topic(active, total, count)
+            question_ids = self.get_active_question_ids([self.id])[self.id]
+        
+        # Can't get more questions than available
+        return random.sample(question_ids, min(count, len(question_ids)))
+    
+    @staticmethod
+    def _sample_large_topic(active, total, count):
+        """
+        Keep each row with probability ~3*count/total in SQL so only about
+        3*count IDs cross the wire, then sample exactly `count` of them.
+        Falls back to streaming reservoir sampling if the backend has no
+        random() expression or the filter kept too few rows.
+        """
+        random_fraction = RANDOM_FRACTION_SQL.get(connections[active.db].vendor)
+        if random_fraction:
+            fraction = min(1.0, 3.0 * count / total)
+            sampled = list(
+                active.annotate(
+                    sample_key=RawSQL(random_fraction, (), output_field=models.FloatField())
+                ).filter(sample_key__lt=fraction).values_list('id', flat=True)
+            )
+            if len(sampled) >= count:
+                return random.sample(sampled, count)
+        
+        return reservoir_sample(
+            active.values_list('id', flat=True).iterator(chunk_size=4096), count
+        )
+    
     def get_random_questions(self, count=None):
         if count is None:
             count = self.questions_per_test
         
-        question_ids = list(
-            self.questions.filter(is_active=True).values_list('id', flat=True)
-        )
+        selected_ids = self.sample_question_ids(count)
         
-        # Can't get more questions than available
-        actual_count = min(count, len(question_ids))
-        
-        if actual_count == 0:
+        if not selected_ids:
             return self.questions.none()
         
-        # Random sample in Python (very fast, O(n))
-        selected_ids = random.sample(question_ids, actual_count)
-        
         # Note: id__in doesn't preserve order, but we don't need order
         return self.questions.filter(id__in=selected_ids)
 
@@ -457,13 +613,53 @@ class Question(models.Model):
     class Meta:
         ordering = ['topic', 'difficulty_level', 'created_at']
         indexes = [
-            models.Index(fields=['topic', 'is_active']),
+            # Trailing id lets active-ID lookups per topic use an index-only scan
+            models.Index(fields=['topic', 'is_active', 'id'], name='q_topic_active_id_idx'),
             models.Index(fields=['is_active']),
             models.Index(fields=['question_type']),
         ]
     
     def __str__(self):
         return f"{self.topic.name} - {self.question_type} - {self.question_text[:50]}"
+    
+    @cached_property
+    def hotspot_regions(self):
+        """
+        Hotspot regions as an (N, 4) array of x, y, width, height.
+        Decoded once per process for each saved version of the question.
+        """
+        key = (self.pk, self.updated_at)
+        regions = _HOTSPOT_REGIONS_CACHE.get(key) if self.pk else None
+        if regions is None:
+            regions = np.array(
+                [
+                    (region['x'], region['y'], region['width'], region['height'])
+                    for region in self.hotspot_coordinates or []
+                ],
+                dtype=np.float64
+            ).reshape(-1, 4)
+            regions.flags.writeable = False  # shared between instances
+            if self.pk:
+                if len(_HOTSPOT_REGIONS_CACHE) >= HOTSPOT_REGIONS_CACHE_SIZE:
+                    _HOTSPOT_REGIONS_CACHE.clear()
+                _HOTSPOT_REGIONS_CACHE[key] = regions
+        return regions
+    
+    @cached_property
+    def hotspot_boxes(self):
+        """Hotspot regions as ((x0, y0, x1, y1), ...) for the scalar click check"""
+        return tuple(
+            (region['x'], region['y'], region['x'] + region['width'], region['y'] + region['height'])
+            for region in self.hotspot_coordinates or ()
+        )
+
+
+class CohortQuerySet(models.QuerySet):
+    def with_enabled_categories(self):
+        """Fetch enabled category IDs for all cohorts in one extra query"""
+        return self.prefetch_related(
+            models.Prefetch('enabled_categories', queryset=TestCategory.objects.only('id'))
+        )
 
 
 class Cohort(models.Model):
@@ -482,15 +678,24 @@ class Cohort(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = CohortQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-start_date']
     
     def __str__(self):
         return self.name
     
+    @cached_property
+    def enabled_category_ids(self):
+        """IDs of enabled categories; reuses prefetched rows when available"""
+        if 'enabled_categories' in getattr(self, '_prefetched_objects_cache', {}):
+            return {category.id for category in self.enabled_categories.all()}
+        return set(self.enabled_categories.values_list('id', flat=True))
+    
     def is_test_available(self, category):
         """Check if a test category is available for this cohort"""
-        return self.enabled_categories.filter(id=category.id).exists()
+        return category.id in self.enabled_category_ids
 
 
 class CohortMembership(models.Model):
@@ -553,6 +758,12 @@ class Test(models.Model):
         help_text="Interval between webcam/screen snapshots (120-300 seconds)"
     )
     
+    # Questions per attempt, kept current by save() and the
+    # update_test_total_questions / update_category_test_total_questions receivers.
+    # NULL means not computed yet (rows written by bulk_create/update bypass save());
+    # 0 is a real total.
+    total_questions_cached = models.IntegerField(null=True, default=None, editable=False)
+    
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -563,12 +774,55 @@ class Test(models.Model):
     def __str__(self):
         return f"{self.category.name} - {self.title}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Loaded inputs of total_questions_cached, compared in save()
+        instance._loaded_question_source = (
+            instance.__dict__.get('category_id'),
+            instance.__dict__.get('auto_generate_from_topics'),
+        )
+        return instance
+    
+    def save(self, *args, **kwargs):
+        """Recompute total_questions_cached when its category or mode changes"""
+        source = (self.category_id, self.auto_generate_from_topics)
+        if source != getattr(self, '_loaded_question_source', None):
+            self.refresh_total_questions_cached()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'total_questions_cached'}
+        super().save(*args, **kwargs)
+        self._loaded_question_source = source
+    
+    def refresh_total_questions_cached(self):
+        """Set total_questions_cached from the distributions or category topics"""
+        distributions = TestTopicDistribution.objects.filter(test_id=self.pk).aggregate(
+            count=Count('id'), total=Sum('num_questions')
+        )
+        if distributions['count']:
+            total = distributions['total'] or 0
+        elif self.auto_generate_from_topics:
+            total = QuestionTopic.objects.filter(
+                category_id=self.category_id
+            ).aggregate(total=Sum('questions_per_test'))['total'] or 0
+        else:
+            total = 0
+        self.total_questions_cached = total
+        self.__dict__.pop('total_questions', None)
+    
     def get_total_questions(self):
-
+        """Number of questions per attempt (memoized on the instance)"""
+        return self.total_questions
+    
+    @cached_property
+    def total_questions(self):
+        """Number of questions per attempt, from the cached total when available"""
         if self.auto_generate_from_topics:
-            # Use topic distributions if configured
-            from django.db.models import Sum
+            if self.total_questions_cached is not None:
+                return self.total_questions_cached
             
+            # Use topic distributions if configured
             distributions = self.topic_distributions.all()
             if distributions.exists():
                 # Aggregate sum directly in database (fast!)
@@ -587,41 +841,49 @@ class Test(models.Model):
         return self.manual_questions.count()
     
     def generate_question_set(self):
-
-        questions = []
-        
-        # Prefetch related data to reduce queries
-        distributions = self.topic_distributions.all().select_related(
-            'topic',
-            'topic__category'
+        """
+        Pick random question IDs for every topic of this test, grouped by
+        topic in distribution order.
+        Samples all topics from one (cached) ID lookup instead of calling
+        QuestionTopic.get_random_questions() per topic.
+        """
+        # (topic_id, count) pairs in display order
+        distributions = list(
+            self.topic_distributions.values_list('topic_id', 'num_questions')
         )
-        
-        if distributions.exists():
-            # Multi-topic distribution mode
-            for dist in distributions:
-                topic_questions = dist.topic.get_random_questions(dist.num_questions)
-                # Convert to list immediately for better performance
-                questions.extend(list(topic_questions))
-        else:
+        if not distributions:
             # Fallback: Old single-category mode
-            topics = self.category.topics.all()
-            for topic in topics:
-                topic_questions = topic.get_random_questions()
-                questions.extend(list(topic_questions))
+            distributions = list(
+                self.category.topics.values_list('id', 'questions_per_test')
+            )
+        
+        topic_ids = [topic_id for topic_id, _ in distributions]
+        ids_by_topic = QuestionTopic.get_active_question_ids(topic_ids)
         
-        return questions
+        selected_ids = []
+        for topic_id, count in distributions:
+            question_ids = ids_by_topic[topic_id]
+            selected_ids.extend(random.sample(question_ids, min(count, len(question_ids))))
+        return selected_ids
     
     def get_distribution_summary(self):
         """
         Get a summary of question distribution for display.
         Returns: "5 from Verbal, 5 from Numerical, 5 from Spatial (Total: 15)"
         """
-        distributions = self.topic_distributions.all().order_by('order')
-        if not distributions.exists():
-            return f"{self.get_total_questions()} from {self.category.name}"
+        # One joined query, no model instances
+        distributions = self.topic_distributions.order_by('order').values_list(
+            'num_questions', 'topic__name'
+        )
         
-        parts = [f"{d.num_questions} from {d.topic.name}" for d in distributions]
-        total = sum(d.num_questions for d in distributions)
+        parts = []
+        total = 0
+        for num_questions, topic_name in distributions:
+            parts.append(f"{num_questions} from {topic_name}")
+            total += num_questions
+        
+        if not parts:
+            return f"{self.get_total_questions()} from {self.category.name}"
         return f"{', '.join(parts)} (Total: {total})"
 
 
@@ -646,10 +908,25 @@ class TestTopicDistribution(models.Model):
     def __str__(self):
         return f"{self.test.title} - {self.topic.name}: {self.num_questions} questions"
     
+    @classmethod
+    def available_question_counts(cls, topic_ids):
+        """Active question count per topic, from one grouped query"""
+        counts = dict.fromkeys(topic_ids, 0)
+        rows = Question.objects.filter(
+            topic_id__in=counts, is_active=True
+        ).values('topic_id').annotate(c=Count('id'))
+        counts.update((row['topic_id'], row['c']) for row in rows)
+        return counts
+    
     def clean(self):
         """Validate that topic has enough questions"""
         from django.core.exceptions import ValidationError
-        available = self.topic.questions.filter(is_active=True).count()
+        counts = getattr(self, '_available_counts', None)
+        if counts is not None and self.topic_id in counts:
+            # Primed by the admin formset (TestTopicDistributionFormSet)
+            available = counts[self.topic_id]
+        else:
+            available = self.topic.questions.filter(is_active=True).count()
         if self.num_questions > available:
             raise ValidationError(
                 f"Topic '{self.topic.name}' only has {available} active questions, "
@@ -657,6 +934,12 @@ class TestTopicDistribution(models.Model):
             )
 
 
+class TestAttemptQuerySet(models.QuerySet):
+    def with_display(self):
+        """Join the rows list pages dereference (user, test, category, cohort)"""
+        return self.select_related('user', 'test', 'test__category', 'cohort')
+
+
 class TestAttempt(models.Model):
     """
     Individual test attempt by a user
@@ -675,7 +958,9 @@ class TestAttempt(models.Model):
     
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='started')
     score = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
-    passed = models.BooleanField(null=True, blank=True)
+    # Generated column: the database trigger derives it from score on every
+    # INSERT/UPDATE (see PASSED_TRIGGER_SQL), so it is never edited directly
+    passed = models.BooleanField(null=True, blank=True, editable=False)
     
     # Proctoring data
     ip_address = models.GenericIPAddressField(blank=True, null=True)
@@ -684,8 +969,10 @@ class TestAttempt(models.Model):
     consent_timestamp = models.DateTimeField(null=True, blank=True)
     
     # Timing
-    started_at = models.DateTimeField(null=True, blank=True)
-    completed_at = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # started_at + test time limit, recomputed by save() when started_at changes
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True, editable=False)
+    completed_at = models.DateTimeField(null=True, blank=True, db_index=True)
     time_spent_seconds = models.IntegerField(null=True, blank=True)
     
     # Plagiarism detection
@@ -696,12 +983,15 @@ class TestAttempt(models.Model):
     )
     flagged_for_plagiarism = models.BooleanField(default=False)
     
-    # Generated question set (JSON of question IDs)
+    # Legacy JSON list of question IDs; only read for rows that the
+    # backfill_question_sets command has not packed yet
     question_set = models.JSONField(
         null=True,
         blank=True,
         help_text="List of question IDs for this attempt"
     )
+    # Generated question set as little-endian uint32; read through `question_ids`
+    question_set_packed = models.BinaryField(null=True, blank=True, editable=False)
     
     metadata = models.JSONField(
         null=True,
@@ -710,10 +1000,15 @@ class TestAttempt(models.Model):
         help_text="Additional metadata including disqualification info, proctoring flags, etc."
     )
     
+    objects = TestAttemptQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-started_at']
         indexes = [
             models.Index(fields=['user', 'test']),
+            models.Index(fields=['user', 'status', '-started_at'], name='ta_user_status_started'),
+            models.Index(fields=['test', 'status'], name='ta_test_status'),
+            models.Index(fields=['test', '-started_at'], name='ta_test_started'),
             models.Index(fields=['status', 'completed_at']),
             models.Index(fields=['flagged_for_plagiarism']),
         ]
@@ -721,75 +1016,236 @@ class TestAttempt(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.test.title} - {self.status}"
     
-    def is_expired(self):
-        """Check if test time has expired"""
+    @property
+    def question_ids(self):
+        """Question IDs for this attempt, decoded from the packed column"""
+        packed = self.question_set_packed
+        if packed is None:
+            # Not backfilled yet
+            return self.question_set
+        return list(struct.unpack_from(f'<{len(packed) // 4}I', packed))
+    
+    @question_ids.setter
+    def question_ids(self, ids):
+        ids = list(ids)
+        self.question_set_packed = struct.pack(f'<{len(ids)}I', *ids)
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded start so save() can tell when it was reset
+        instance._loaded_started_at = instance.__dict__.get('started_at')
+        return instance
+    
+    def save(self, *args, **kwargs):
+        """Override save to recompute expires_at whenever started_at is set or reset"""
+        if self.started_at and (
+            self.expires_at is None
+            or self.started_at != getattr(self, '_loaded_started_at', None)
+        ):
+            self.expires_at = self.started_at + timedelta(minutes=self.test.time_limit_minutes)
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'expires_at'}
+        super().save(*args, **kwargs)
+        self._loaded_started_at = self.started_at
+    
+    def get_expires_at(self):
+        """Deadline for this attempt (computed for rows saved before expires_at existed)"""
+        if self.expires_at is None and self.started_at:
+            return self.started_at + timedelta(minutes=self.test.time_limit_minutes)
+        return self.expires_at
+    
+    def is_expired(self, now=None):
+        """Check if test time has expired (pass `now` to reuse one clock read)"""
         if self.status == 'completed':
             return False
         
         if not self.started_at:
             return False
         
-        time_limit = timedelta(minutes=self.test.time_limit_minutes)
-        return timezone.now() > (self.started_at + time_limit)
+        if now is None:
+            now = timezone.now()
+        return now > self.get_expires_at()
     
-    def time_remaining_seconds(self):
-        """Get remaining time in seconds"""
+    def time_remaining_seconds(self, now=None):
+        """Get remaining time in seconds (pass `now` to reuse one clock read)"""
         if self.status == 'completed':
             return 0
         
         if not self.started_at:
             return self.test.time_limit_minutes * 60
         
-        time_limit = timedelta(minutes=self.test.time_limit_minutes)
-        elapsed = timezone.now() - self.started_at
-        remaining = time_limit - elapsed
-        
-        return max(0, int(remaining.total_seconds()))
+        if now is None:
+            now = timezone.now()
+        return max(0, int((self.get_expires_at() - now).total_seconds()))
     
-    def calculate_score(self):
-        """Calculate the test score based on answers"""
-        total_points = 0
-        earned_points = 0
+    @classmethod
+    def expire_stale(cls, now=None):
+        """
+        Mark every running attempt past its deadline as expired in one UPDATE.
+        'started' attempts are skipped: the candidate has not consented yet
+        and the deadline is recomputed when they do.
+        """
+        if now is None:
+            now = timezone.now()
+        return cls.objects.filter(
+            status='in_progress',
+            expires_at__lt=now
+        ).update(status='expired')
+    
+    def calculate_score(self, *extra_fields, send_signals=False):
+        """
+        Calculate the test score based on answers and store it with a
+        single UPDATE. Names in `extra_fields` are other attributes changed
+        on this instance that should be written by the same statement.
+        Pass send_signals=True to save through save(update_fields=...) so
+        pre_save/post_save receivers run.
+        """
+        if getattr(settings, 'SCORE_IN_DATABASE', False):
+            # Persist pending changes, then score in a single statement
+            if extra_fields:
+                self.save(update_fields=extra_fields)
+            self.score, self.passed = type(self).finalize(self.pk)
+            return self.score
         
-        for answer in self.answers.select_related('question').all():
-            total_points += answer.question.points
-            if answer.is_correct:
-                earned_points += answer.question.points
+        # Sum points in the database rather than iterating answers
+        points = self.answers.aggregate(
+            total=Sum('question__points'),
+            earned=Sum('question__points', filter=Q(is_correct=True))
+        )
+        total_points = points['total'] or 0
+        earned_points = points['earned'] or 0
         
         if total_points == 0:
             self.score = 0
         else:
             self.score = round((earned_points / total_points) * 100, 2)
         
-        # Determine pass/fail
-        passing_threshold = self.test.passing_score
-        self.passed = self.score >= passing_threshold
+        # Pass/fail is derived from score by the database trigger; backends
+        # without one (see PASSED_TRIGGER_SQL) get it computed here
+        db = router.db_for_write(type(self), instance=self)
+        has_trigger = connections[db].vendor in PASSED_TRIGGER_SQL
+        if not has_trigger:
+            self.passed = self.score >= self.test.passing_score
+            extra_fields = ('passed', *extra_fields)
         
-        self.save()
+        if send_signals:
+            self.save(update_fields=['score', *extra_fields])
+        else:
+            type(self).objects.filter(pk=self.pk).update(
+                score=self.score,
+                **{field: getattr(self, field) for field in extra_fields}
+            )
+        if has_trigger:
+            self.refresh_from_db(fields=['passed'])
         return self.score
     
+    def create_blank_answers(self, question_ids):
+        """
+        Create an unanswered Answer row per question in one bulk INSERT.
+        Existing answers are left untouched.
+        """
+        return Answer.objects.bulk_create(
+            [Answer(attempt=self, question_id=question_id) for question_id in question_ids],
+            batch_size=500,
+            ignore_conflicts=True
+        )
+    
+    @classmethod
+    def finalize(cls, attempt_id):
+        """
+        Score an attempt entirely in the database: one statement computes the
+        points-weighted percentage and pass/fail and returns (score, passed).
+        """
+        # passed is also set here because SQLite's AFTER trigger runs too
+        # late to be visible through RETURNING
+        sql = """
+            WITH graded AS (
+                SELECT COALESCE(ROUND(
+                    100.0 * SUM(CASE WHEN a.is_correct THEN q.points ELSE 0 END)
+                    / NULLIF(SUM(q.points), 0), 2), 0) AS score
+                FROM assessment_answer a
+                JOIN assessment_question q ON q.id = a.question_id
+                WHERE a.attempt_id = %s
+            )
+            UPDATE assessment_testattempt
+            SET score = (SELECT score FROM graded),
+                passed = (SELECT score FROM graded) >= (
+                    SELECT passing_score FROM assessment_test
+                    WHERE id = assessment_testattempt.test_id
+                )
+            WHERE id = %s
+            RETURNING score, passed
+        """
+        with connections[router.db_for_write(cls)].cursor() as cursor:
+            cursor.execute(sql, [attempt_id, attempt_id])
+            score, passed = cursor.fetchone()
+        return round(cls._meta.get_field('score').to_python(score), 2), bool(passed)
+    
     def get_skill_gaps(self):
         """Identify topics where user performed poorly"""
         
+        # One grouped query instead of two counts per topic
+        rows = self.answers.values(
+            'question__topic_id', 'question__topic__name'
+        ).annotate(
+            total=Count('id'),
+            correct=Count('id', filter=Q(is_correct=True))
+        ).order_by('question__topic__name')
+        
         topic_performance = []
-        for topic in self.test.category.topics.all():
-            topic_answers = self.answers.filter(question__topic=topic)
-            if topic_answers.exists():
-                correct_count = topic_answers.filter(is_correct=True).count()
-                total_count = topic_answers.count()
-                percentage = (correct_count / total_count) * 100 if total_count > 0 else 0
-                
-                topic_performance.append({
-                    'topic': topic.name,
-                    'percentage': round(percentage, 2),
-                    'correct': correct_count,
-                    'total': total_count,
-                    'is_gap': percentage < 60  # Below 60% is a gap
-                })
+        for row in rows:
+            percentage = (row['correct'] / row['total']) * 100
+            topic_performance.append({
+                'topic': row['question__topic__name'],
+                'percentage': round(percentage, 2),
+                'correct': row['correct'],
+                'total': row['total'],
+                'is_gap': percentage < 60  # Below 60% is a gap
+            })
         
         return topic_performance
 
 
+class TestStats(models.Model):
+    """
+    Per-test attempt and pass counts, read from the assessment_test_stats
+    view (materialized on PostgreSQL, see TEST_STATS_VIEW_SQL). Shown in the
+    Test admin list; may lag by up to one refresh_test_stats run.
+    """
+    test = models.OneToOneField(
+        Test,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        related_name='stats'
+    )
+    total = models.IntegerField()
+    passed_count = models.IntegerField()
+    
+    class Meta:
+        managed = False
+        db_table = 'assessment_test_stats'
+        verbose_name_plural = 'Test Stats'
+    
+    def __str__(self):
+        return f"{self.test.title}: {self.passed_count}/{self.total} passed"
+    
+    @property
+    def pass_rate(self):
+        """Percentage of attempts that passed"""
+        return (self.passed_count / self.total) * 100 if self.total else 0
+    
+    @classmethod
+    def refresh(cls, using=None):
+        """Recompute the materialized view (no-op where it is a plain view)"""
+        connection = connections[using or router.db_for_write(cls)]
+        if connection.vendor != 'postgresql':
+            return
+        with connection.cursor() as cursor:
+            cursor.execute('REFRESH MATERIALIZED VIEW CONCURRENTLY assessment_test_stats')
+
+
 class Answer(models.Model):
     """
     User's answer to a specific question in a test attempt
@@ -847,52 +1303,172 @@ class Answer(models.Model):
     answered_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
-        ordering = ['answered_at']
+        # No default ordering; listings order explicitly (by answered_at)
         unique_together = ['attempt', 'question']
         indexes = [
             models.Index(fields=['attempt', 'is_correct']),
+            # Covers the scoring aggregate (join on question, test is_correct)
+            # without heap reads; key columns rather than INCLUDE so it also
+            # covers on SQLite
+            models.Index(fields=['attempt', 'question', 'is_correct'], name='ans_att_q_correct_idx'),
+            # Plagiarism self-join on matching MCQ answers
+            models.Index(fields=['question', 'selected_answer'], name='ans_q_selected_idx'),
         ]
     
     def __str__(self):
         return f"{self.attempt.user.username} - Q{self.question.id} - {self.selected_answer}"
     
+    # Columns grade() reads; load ungraded answers with .only(*GRADING_FIELDS)
+    # to skip question text, options and other heavy columns
+    GRADING_FIELDS = (
+        'is_correct', 'selected_answer', 'clicked_coordinates', 'dice_score',
+        'question__question_type', 'question__correct_answer',
+        'question__hotspot_coordinates', 'question__dice_threshold', 'question__updated_at',
+    )
+    
+    def _grade_choice(self):
+        return bool(self.selected_answer) and self.selected_answer == self.question.correct_answer
+    
+    def _grade_hotspot(self):
+        # Check if clicked coordinates are within hotspot regions
+        if self.clicked_coordinates and self.question.hotspot_coordinates:
+            return self._check_hotspot_click()
+        return False
+    
+    def _grade_annotation(self):
+        # Dice coefficient calculated separately via command
+        return self.dice_score >= self.question.dice_threshold if self.dice_score else False
+    
+    # question_type -> grader, built once instead of comparing types per call
+    _GRADERS = {
+        'mcq': _grade_choice,
+        'image': _grade_choice,
+        'spatial': _grade_choice,
+        'verbal': _grade_choice,
+        'numerical': _grade_choice,
+        'pattern': _grade_choice,
+        'error_detection': _grade_choice,
+        'dicom': _grade_hotspot,
+        'annotation': _grade_annotation,
+    }
+    # Types graded by _grade_choice, which the database can grade in one UPDATE
+    CHOICE_TYPES = ('mcq', 'image', 'spatial', 'verbal', 'numerical', 'pattern', 'error_detection')
+    
+    def grade(self):
+        """Set is_correct from the response without saving"""
+        grader = self._GRADERS.get(self.question.question_type)
+        self.is_correct = grader(self) if grader else False
+        return self.is_correct
+    
     def check_answer(self):
-        """Check if the selected answer is correct"""
-        if self.question.question_type in ['mcq', 'image', 'spatial', 'verbal', 'numerical', 'pattern', 'error_detection']:
-            if self.selected_answer:
-                self.is_correct = (self.selected_answer == self.question.correct_answer)
-            else:
-                self.is_correct = False
-            self.save()
-            
-        elif self.question.question_type == 'dicom':
-            # Check if clicked coordinates are within hotspot regions
-            if self.clicked_coordinates and self.question.hotspot_coordinates:
-                self.is_correct = self._check_hotspot_click()
-            else:
-                self.is_correct = False
-            self.save()
-            
-        elif self.question.question_type == 'annotation':
-            # Dice coefficient calculated separately via command
-            self.is_correct = self.dice_score >= self.question.dice_threshold if self.dice_score else False
-            self.save()
-        else:
-            self.is_correct = False
-            self.save()
-        
+        """Check if the selected answer is correct and store the result"""
+        self.grade()
+        self.save(update_fields=['is_correct'])
         return self.is_correct
     
+    @classmethod
+    def grade_all(cls, answers):
+        """Grade many answers and store them with one bulk UPDATE"""
+        for answer in answers:
+            answer.grade()
+        cls.objects.bulk_update(answers, fields=['is_correct'], batch_size=500)
+    
+    @classmethod
+    def bulk_check_choices(cls, attempt):
+        """
+        Grade the attempt's unchecked choice answers with a single UPDATE.
+        Returns the number of answers graded.
+        """
+        return attempt.answers.filter(
+            is_correct__isnull=True,
+            question__question_type__in=cls.CHOICE_TYPES
+        ).update(
+            is_correct=Exists(
+                Question.objects.filter(
+                    pk=OuterRef('question_id'),
+                    correct_answer=OuterRef('selected_answer')
+                ).exclude(correct_answer='')
+            )
+        )
+    
+    @classmethod
+    def check_answers_bulk(cls, attempt):
+        """
+        Grade every not-yet-checked answer of an attempt: choice answers in
+        SQL, hotspot clicks with the vectorized kernel, the rest (annotation)
+        in one read and one write.
+        Returns the number of answers graded.
+        """
+        graded = cls.bulk_check_choices(attempt)
+        graded += cls.recheck_hotspots_bulk(attempt.answers.filter(is_correct__isnull=True))
+        answers = list(
+            attempt.answers.filter(is_correct__isnull=True)
+            .select_related('question')
+            .only(*cls.GRADING_FIELDS)
+        )
+        cls.grade_all(answers)
+        return graded + len(answers)
+    
+    @classmethod
+    def recheck_hotspots_bulk(cls, queryset):
+        """
+        Re-grade the DICOM hotspot answers in `queryset` with one vectorized
+        kernel call (see assessment.scoring) and one bulk UPDATE.
+        Returns the number of answers re-graded.
+        """
+        from .scoring import hotspot_hits
+        
+        answers = list(
+            queryset.filter(question__question_type='dicom')
+            .select_related('question')
+            .only(*cls.GRADING_FIELDS)
+        )
+        if not answers:
+            return 0
+        
+        # Each question's regions are stored once; answers point at their block
+        blocks = {}
+        region_arrays = []
+        offset = 0
+        starts = np.empty(len(answers), dtype=np.int64)
+        counts = np.empty(len(answers), dtype=np.int64)
+        cx = np.full(len(answers), np.nan)
+        cy = np.full(len(answers), np.nan)
+        for i, answer in enumerate(answers):
+            question = answer.question
+            if question.pk not in blocks:
+                regions = question.hotspot_regions
+                blocks[question.pk] = (offset, len(regions))
+                region_arrays.append(regions)
+                offset += len(regions)
+            starts[i], counts[i] = blocks[question.pk]
+            click = answer.clicked_coordinates or {}
+            if click.get('x') is not None and click.get('y') is not None:
+                cx[i], cy[i] = click['x'], click['y']
+        
+        hits = hotspot_hits(cx, cy, np.concatenate(region_arrays), starts, counts)
+        for answer, hit in zip(answers, hits):
+            answer.is_correct = bool(hit)
+        cls.objects.bulk_update(answers, fields=['is_correct'], batch_size=500)
+        return len(answers)
+    
     def _check_hotspot_click(self):
         """Check if click is within any correct hotspot region"""
         click_x = self.clicked_coordinates.get('x')
         click_y = self.clicked_coordinates.get('y')
         
-        for region in self.question.hotspot_coordinates:
-            x, y, w, h = region['x'], region['y'], region['width'], region['height']
-            if x <= click_x <= x + w and y <= click_y <= y + h:
-                return True
-        return False
+        boxes = self.question.hotspot_boxes
+        if len(boxes) < HOTSPOT_VECTORIZE_MIN_REGIONS:
+            # Scalar path: NumPy call overhead outweighs a few comparisons
+            for x0, y0, x1, y1 in boxes:
+                if x0 <= click_x <= x1 and y0 <= click_y <= y1:
+                    return True
+            return False
+        
+        x, y, w, h = self.question.hotspot_regions.T
+        return bool(np.any(
+            (x <= click_x) & (click_x <= x + w) & (y <= click_y) & (click_y <= y + h)
+        ))
 
 
 class ProctoringEvent(models.Model):
@@ -976,7 +1552,8 @@ class ProctoringEvent(models.Model):
         help_text="Event severity for admin review"
     )
     
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: buffered events keep the time they were queued
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     
     is_event_screenshot = models.BooleanField(
         default=False,
@@ -984,12 +1561,18 @@ class ProctoringEvent(models.Model):
     )
     
     class Meta:
-        ordering = ['-timestamp']  # Changed to descending for latest first
+        # No default ordering so counts/aggregates skip the sort; timelines
+        # order explicitly (latest first in the admin)
         indexes = [
-            models.Index(fields=['attempt', 'event_type']),
+            # Per-type timelines (review page) read in timestamp order
+            models.Index(fields=['attempt', 'event_type', 'timestamp'], name='pe_attempt_type_ts_idx'),
+            models.Index(fields=['attempt', '-timestamp'], name='pe_attempt_ts_idx'),
             models.Index(fields=['timestamp']),
             models.Index(fields=['severity']),
             models.Index(fields=['is_event_screenshot']),
+            # Partial indexes for the review page's per-attempt lookups
+            models.Index(fields=['attempt', 'timestamp'], condition=Q(severity='critical'), name='pe_critical_idx'),
+            models.Index(fields=['attempt'], condition=Q(is_event_screenshot=True), name='pe_event_screenshot_idx'),
         ]
     
     def __str__(self):
@@ -997,6 +1580,25 @@ class ProctoringEvent(models.Model):
         event_marker = ' [EVENT]' if self.is_event_screenshot else ''
         return f"{severity_icon} {self.attempt.user.username} - {self.event_type}{event_marker} - {self.timestamp}"
     
+    @classmethod
+    def buffer_create(cls, attempt, event_type, metadata=None, severity='info'):
+        """
+        Queue a non-critical event for the next bulk insert (see
+        proctoring_buffer). Critical events, and every event when buffering
+        is off or Redis is unreachable, are written immediately.
+        Returns the created event, or None if it was queued.
+        """
+        from .proctoring_buffer import buffering_enabled, event_buffer
+        if (severity != 'critical' and buffering_enabled() and
+                event_buffer.append(attempt.pk, event_type, severity, metadata)):
+            return None
+        return cls.objects.create(
+            attempt=attempt,
+            event_type=event_type,
+            severity=severity,
+            metadata=metadata
+        )
+    
     @classmethod
     def cleanup_old_snapshots(cls, days=30):
         """Delete proctoring data older than specified days"""
@@ -1004,11 +1606,79 @@ class ProctoringEvent(models.Model):
         from django.utils import timezone
         
         cutoff_date = timezone.now() - timedelta(days=days)
-        old_events = cls.objects.filter(timestamp__lt=cutoff_date)
-        count = old_events.count()
-        old_events.delete()
+        storage = cls._meta.get_field('image_file').storage
+        
+        # Delete in bounded batches so memory use and lock time stay small
+        count = 0
+        while True:
+            batch = list(
+                cls.objects.filter(timestamp__lt=cutoff_date)
+                .order_by()
+                .values_list('pk', 'image_file')[:CLEANUP_BATCH_SIZE]
+            )
+            if not batch:
+                break
+            
+            # Remove uploaded images first so no files are orphaned
+            for _, image_name in batch:
+                if image_name:
+                    storage.delete(image_name)
+            
+            deleted, _ = cls.objects.filter(pk__in=[pk for pk, _ in batch]).delete()
+            count += deleted
         return count
     
+    @staticmethod
+    def compress_snapshot(image):
+        """Downscale a snapshot to at most 640x480 and encode it as a ~200KB JPEG"""
+        import cv2
+        from PIL import Image
+        
+        header = Image.open(image)  # reads the header only
+        width, height = header.size
+        image.seek(0)
+        data = image.read()
+        if header.format == 'JPEG' and width <= 640 and height <= 480:
+            # Already a small JPEG: store the upload as is, skipping decode/encode
+            return data
+        
+        # Decode JPEGs at the smallest DCT scale (1/2, 1/4, 1/8) still covering the target
+        scale = min(640 / width, 480 / height, 1.0)
+        flags = cv2.IMREAD_COLOR
+        for factor, reduced in ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                                (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if scale * factor <= 1:
+                flags = reduced
+                break
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+        if img is None:
+            raise ValueError("Could not decode snapshot image")
+        
+        target = (max(1, round(width * scale)), max(1, round(height * scale)))
+        if img.shape[1] > target[0] or img.shape[0] > target[1]:
+            img = cv2.resize(img, target, interpolation=cv2.INTER_AREA)
+        
+        # No JPEG_OPTIMIZE: the extra Huffman pass costs encode time for a few bytes
+        ok, buf = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 70])
+        if not ok:
+            raise ValueError("Could not encode snapshot image")
+        return buf.tobytes()
+    
+    def compress_image_file(self, filename):
+        """Replace the raw uploaded snapshot with its compressed JPEG"""
+        from django.core.files.base import ContentFile
+        
+        raw_name = self.image_file.name
+        with self.image_file.open('rb') as raw:
+            data = self.compress_snapshot(raw)
+        
+        self.metadata = {**(self.metadata or {}), 'compressed_size': len(data)}
+        self.metadata.pop('compression_pending', None)
+        self.image_file.save(filename, ContentFile(data), save=False)
+        self.save(update_fields=['image_file', 'metadata'])
+        self.image_file.storage.delete(raw_name)
+    
     def is_critical(self):
         """Check if this event is critical"""
         critical_types = ['camera_disabled', 'camera_permission_denied']
@@ -1054,20 +1724,236 @@ class PlagiarismFlag(models.Model):
     reviewed_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
-        ordering = ['-detected_at']
+        # No default ordering; the admin lists newest detections first
         indexes = [
             models.Index(fields=['reviewed', 'similarity_percentage']),
         ]
+        constraints = [
+            models.UniqueConstraint(fields=['attempt1', 'attempt2'], name='plagiarism_pair_unique'),
+        ]
     
     def __str__(self):
         return f"{self.attempt1.user.username} vs {self.attempt2.user.username} - {self.similarity_percentage}%"
+    
+    @classmethod
+    def detect(cls, since=None, min_matches=None, threshold=None):
+        """
+        Flag pairs of completed attempts on the same test with matching MCQ answers.
+        
+        Pairs are found by one self-join of Answer on (question, selected_answer)
+        grouped by attempt pair; only attempts completed after `since` are
+        compared against the rest. Returns the number of new flags.
+        """
+        if min_matches is None:
+            min_matches = getattr(settings, 'PLAGIARISM_MIN_MATCHES', 5)
+        if threshold is None:
+            threshold = getattr(settings, 'PLAGIARISM_SIMILARITY_THRESHOLD', 90.0)
+        if since is None:
+            from datetime import timedelta
+            from django.utils import timezone
+            since = timezone.now() - timedelta(days=1)
+        
+        connection = connections[router.db_for_write(cls)]
+        sql = f"""
+            SELECT a1.attempt_id, a2.attempt_id, COUNT(*),
+                   {QUESTION_ID_LIST_SQL[connection.vendor]}
+            FROM {Answer._meta.db_table} a1
+            JOIN {Answer._meta.db_table} a2
+              ON a2.question_id = a1.question_id
+             AND a2.selected_answer = a1.selected_answer
+             AND a2.attempt_id > a1.attempt_id
+            JOIN {TestAttempt._meta.db_table} t1 ON t1.id = a1.attempt_id
+            JOIN {TestAttempt._meta.db_table} t2 ON t2.id = a2.attempt_id
+            WHERE a1.selected_answer IS NOT NULL
+              AND t1.test_id = t2.test_id
+              AND t1.status = 'completed' AND t2.status = 'completed'
+              AND (t1.completed_at >= %s OR t2.completed_at >= %s)
+            GROUP BY a1.attempt_id, a2.attempt_id
+            HAVING COUNT(*) >= %s
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [since, since, min_matches])
+            pairs = cursor.fetchall()
+        if not pairs:
+            return 0
+        
+        # Similarity is relative to the attempt that answered fewer MCQs
+        attempt_ids = {pk for pair in pairs for pk in pair[:2]}
+        answered = dict(
+            Answer.objects.filter(attempt_id__in=attempt_ids, selected_answer__isnull=False)
+            .order_by().values('attempt_id').annotate(n=Count('id'))
+            .values_list('attempt_id', 'n')
+        )
+        
+        flags = []
+        similarity = {}
+        for attempt1_id, attempt2_id, matches, question_ids in pairs:
+            percentage = round(100.0 * matches / min(answered[attempt1_id], answered[attempt2_id]), 2)
+            if percentage < threshold:
+                continue
+            flags.append(cls(
+                attempt1_id=attempt1_id,
+                attempt2_id=attempt2_id,
+                similarity_percentage=percentage,
+                matching_answers=sorted(int(pk) for pk in question_ids.split(',')),
+            ))
+            for pk in (attempt1_id, attempt2_id):
+                similarity[pk] = max(similarity.get(pk, 0.0), percentage)
+        
+        # Pairs flagged by earlier runs are skipped by the unique constraint,
+        # so only pairs missing beforehand count as new
+        new_pairs = {(flag.attempt1_id, flag.attempt2_id) for flag in flags}
+        new_pairs -= set(
+            cls.objects.filter(attempt1_id__in=attempt_ids, attempt2_id__in=attempt_ids)
+            .values_list('attempt1_id', 'attempt2_id')
+        )
+        cls.objects.bulk_create(flags, ignore_conflicts=True, batch_size=1000)
+        
+        attempts = list(TestAttempt.objects.filter(pk__in=similarity).only('id', 'similarity_score'))
+        for attempt in attempts:
+            attempt.similarity_score = max(attempt.similarity_score or 0.0, similarity[attempt.pk])
+            attempt.flagged_for_plagiarism = True
+        TestAttempt.objects.bulk_update(
+            attempts, fields=['similarity_score', 'flagged_for_plagiarism'], batch_size=500
+        )
+        return len(new_pairs)
+
+@receiver([post_save, post_delete], sender=Question)
+def bump_questions_version(sender, **kwargs):
+    """Invalidate cached topic question IDs when questions change"""
+    try:
+        cache.incr(QUESTIONS_VERSION_KEY)
+    except ValueError:
+        # Key evicted: start a fresh version that cannot match stale entries
+        cache.set(QUESTIONS_VERSION_KEY, time.time_ns(), None)
+
+@receiver([post_save, post_delete], sender=TestTopicDistribution)
+def update_test_total_questions(sender, instance, **kwargs):
+    """Keep Test.total_questions_cached in sync with its distributions"""
+    test = Test.objects.filter(pk=instance.test_id).first()
+    if test is None:
+        # Distribution deleted along with its test
+        return
+    # Falls back to the category topics once the last distribution is gone
+    test.refresh_total_questions_cached()
+    Test.objects.filter(pk=test.pk).update(total_questions_cached=test.total_questions_cached)
+
+@receiver([post_save, post_delete], sender=QuestionTopic)
+def update_category_test_total_questions(sender, instance, **kwargs):
+    """Keep total_questions_cached in sync for tests that sample whole categories"""
+    total = QuestionTopic.objects.filter(
+        category_id=instance.category_id
+    ).aggregate(total=Sum('questions_per_test'))['total'] or 0
+    Test.objects.filter(
+        category_id=instance.category_id,
+        auto_generate_from_topics=True,
+        topic_distributions__isnull=True
+    ).update(total_questions_cached=total)
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     """Create UserProfile when User is created"""
-    if created:
-        #from .models import UserProfile
-        UserProfile.objects.create(user=instance)
-        #pass
+    if created and not kwargs.get('raw'):
+        # get_or_create: a concurrent registration flow may have created it already
+        UserProfile.objects.get_or_create(user=instance)
+
+
+# Database-side derivation of TestAttempt.passed (score >= test.passing_score).
+# Installed after migrate; on backends without an entry calculate_score()
+# sets passed itself.
+PASSED_TRIGGER_SQL = {
+    'postgresql': [
+        """
+        CREATE OR REPLACE FUNCTION assessment_set_passed() RETURNS trigger AS $$
+        BEGIN
+            IF NEW.score IS NULL THEN
+                NEW.passed := NULL;
+            ELSE
+                SELECT NEW.score >= t.passing_score INTO NEW.passed
+                FROM assessment_test t WHERE t.id = NEW.test_id;
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS assessment_testattempt_set_passed ON assessment_testattempt",
+        """
+        CREATE TRIGGER assessment_testattempt_set_passed
+        BEFORE INSERT OR UPDATE ON assessment_testattempt
+        FOR EACH ROW EXECUTE FUNCTION assessment_set_passed()
+        """,
+    ],
+    # SQLite cannot modify NEW, so recompute right after the write instead
+    'sqlite': [
+        """
+        CREATE TRIGGER IF NOT EXISTS assessment_testattempt_passed_insert
+        AFTER INSERT ON assessment_testattempt
+        BEGIN
+            UPDATE assessment_testattempt
+            SET passed = CASE WHEN NEW.score IS NULL THEN NULL ELSE NEW.score >= (
+                SELECT passing_score FROM assessment_test WHERE id = NEW.test_id
+            ) END
+            WHERE id = NEW.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS assessment_testattempt_passed_update
+        AFTER UPDATE OF score, test_id ON assessment_testattempt
+        BEGIN
+            UPDATE assessment_testattempt
+            SET passed = CASE WHEN NEW.score IS NULL THEN NULL ELSE NEW.score >= (
+                SELECT passing_score FROM assessment_test WHERE id = NEW.test_id
+            ) END
+            WHERE id = NEW.id;
+        END
+        """,
+    ],
+}
+
+
+# Pass-rate aggregates behind the unmanaged TestStats model. PostgreSQL
+# materializes them (refreshed by assessment.tasks.refresh_test_stats);
+# SQLite gets a plain view so the model works in development.
+TEST_STATS_VIEW_SQL = {
+    'postgresql': [
+        """
+        CREATE MATERIALIZED VIEW IF NOT EXISTS assessment_test_stats AS
+        SELECT test_id,
+               COUNT(*) AS total,
+               COUNT(*) FILTER (WHERE passed) AS passed_count
+        FROM assessment_testattempt
+        GROUP BY test_id
+        """,
+        # Required by REFRESH ... CONCURRENTLY
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS assessment_test_stats_test_id
+        ON assessment_test_stats (test_id)
+        """,
+    ],
+    'sqlite': [
+        """
+        CREATE VIEW IF NOT EXISTS assessment_test_stats AS
+        SELECT test_id,
+               COUNT(*) AS total,
+               SUM(CASE WHEN passed THEN 1 ELSE 0 END) AS passed_count
+        FROM assessment_testattempt
+        GROUP BY test_id
+        """,
+    ],
+}
 
 
+@receiver(post_migrate)
+def install_database_objects(sender, using='default', **kwargs):
+    """Install the triggers and views that live outside the ORM schema"""
+    if sender.label != 'assessment':
+        return
+    
+    connection = connections[using]
+    statements = (
+        PASSED_TRIGGER_SQL.get(connection.vendor, []) +
+        TEST_STATS_VIEW_SQL.get(connection.vendor, [])
+    )
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
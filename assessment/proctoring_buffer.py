@@ -0,0 +1,140 @@
+"""
+Buffered writes for non-critical proctoring events
+Events are queued per attempt in Redis and inserted with bulk_create by the
+flush_proctoring_events task (and synchronously when a test is submitted)
+"""
+import json
+import logging
+
+import redis
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import ProctoringEvent, TestAttempt
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'proctoring:events:pending'
+# Batches the database rejected (e.g. the attempt was deleted meanwhile)
+DEAD_LETTER_KEY = 'proctoring:events:dead'
+DEAD_LETTER_MAX = 10000
+
+
+def _events_key(attempt_id):
+    return f'proctoring:events:{attempt_id}'
+
+
+class ProctoringEventBuffer:
+    """
+    Redis-backed queue of ProctoringEvent rows awaiting a bulk insert
+    """
+    def __init__(self, url=None):
+        self.url = url or getattr(settings, 'PROCTORING_EVENT_BUFFER_URL', settings.CELERY_BROKER_URL)
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = redis.Redis.from_url(self.url)
+        return self._client
+
+    def append(self, attempt_id, event_type, severity, metadata):
+        """
+        Queue an event. Returns False if Redis is unreachable so the caller
+        can write the event directly instead.
+        """
+        event = json.dumps({
+            'event_type': event_type,
+            'severity': severity,
+            'metadata': metadata,
+            'timestamp': timezone.now().isoformat(),
+        })
+        try:
+            pipe = self.client.pipeline()
+            pipe.rpush(_events_key(attempt_id), event)
+            pipe.sadd(PENDING_KEY, attempt_id)
+            queued = pipe.execute()[0]
+        except redis.RedisError as e:
+            logger.warning("Proctoring event buffer unavailable: %s", e)
+            return False
+        
+        # Event storms flush early instead of waiting for the periodic task
+        if queued == getattr(settings, 'PROCTORING_EVENT_BUFFER_FLUSH_SIZE', 1000):
+            from .tasks import flush_proctoring_events
+            flush_proctoring_events.delay(attempt_id)
+        return True
+
+    def flush(self, attempt_id=None, batch_size=500):
+        """
+        Write queued events for one attempt (or every pending attempt).
+        Returns the number of events inserted.
+        """
+        if attempt_id is None:
+            attempt_ids = [int(member) for member in self.client.smembers(PENDING_KEY)]
+        else:
+            attempt_ids = [attempt_id]
+
+        # Foreign keys are checked at commit, which may be an outer
+        # transaction's, so events of deleted attempts are filtered out first
+        live_ids = set(
+            TestAttempt.objects.filter(pk__in=attempt_ids).values_list('pk', flat=True)
+        )
+
+        written = 0
+        for pending_id in attempt_ids:
+            # Read and clear atomically so concurrent appends are never lost
+            pipe = self.client.pipeline()
+            pipe.lrange(_events_key(pending_id), 0, -1)
+            pipe.delete(_events_key(pending_id))
+            pipe.srem(PENDING_KEY, pending_id)
+            raw_events = pipe.execute()[0]
+            if not raw_events:
+                continue
+            if pending_id not in live_ids:
+                logger.warning(
+                    "Dead-lettering %d buffered proctoring events for deleted attempt %s",
+                    len(raw_events), pending_id
+                )
+                self._dead_letter(pending_id, raw_events)
+                continue
+
+            events = []
+            for raw in raw_events:
+                fields = json.loads(raw)
+                if 'timestamp' in fields:
+                    fields['timestamp'] = parse_datetime(fields['timestamp'])
+                events.append(ProctoringEvent(attempt_id=pending_id, **fields))
+            try:
+                # Savepoint, so a failure doesn't break a surrounding transaction
+                with transaction.atomic():
+                    ProctoringEvent.objects.bulk_create(events, batch_size=batch_size)
+            except DatabaseError:
+                # Retrying would fail the same way on every flush; park the
+                # batch and carry on with the other attempts
+                logger.exception(
+                    "Dead-lettering %d buffered proctoring events for attempt %s",
+                    len(raw_events), pending_id
+                )
+                self._dead_letter(pending_id, raw_events)
+                continue
+            written += len(events)
+        return written
+
+    def _dead_letter(self, attempt_id, raw_events):
+        """Park events that could not be written on the capped dead-letter list"""
+        pipe = self.client.pipeline()
+        pipe.rpush(DEAD_LETTER_KEY, *(
+            json.dumps({'attempt_id': attempt_id, **json.loads(raw)})
+            for raw in raw_events
+        ))
+        pipe.ltrim(DEAD_LETTER_KEY, -DEAD_LETTER_MAX, -1)
+        pipe.execute()
+
+
+def buffering_enabled():
+    return getattr(settings, 'PROCTORING_EVENT_BUFFERING', False)
+
+
+event_buffer = ProctoringEventBuffer()
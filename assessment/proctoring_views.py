@@ -10,9 +10,14 @@ from django.views.decorators.csrf import csrf_exempt
 from django.core.files.base import ContentFile
 from django.utils import timezone
 from django.conf import settings
-from PIL import Image
-from io import BytesIO
+from django.db.models import FloatField, Sum
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import Cast
+from pathlib import Path
+from functools import lru_cache
 import json
+import re
+import uuid
 import cv2
 import numpy as np
 
@@ -24,10 +29,19 @@ except ImportError:
     print("Warning: face_recognition not installed. Face verification disabled.")
 
 from .models import TestAttempt, ProctoringEvent
+from .tasks import compress_proctoring_snapshot
 
 
 # ============ DEVICE DETECTION ============
 
+# Tablet indicators are checked first (more specific)
+TABLET_UA_RE = re.compile(r'tablet|ipad|playbook|silk', re.IGNORECASE)
+MOBILE_UA_RE = re.compile(
+    r'mobile|android|iphone|ipod|blackberry|windows phone|webos', re.IGNORECASE
+)
+
+
+@lru_cache(maxsize=4096)
 def is_mobile_device(user_agent):
     """
     Detect if device is mobile or tablet
@@ -36,26 +50,11 @@ def is_mobile_device(user_agent):
     if not user_agent:
         return False, 'unknown'
     
-    user_agent = user_agent.lower()
-    
-    # Mobile indicators
-    mobile_keywords = [
-        'mobile', 'android', 'iphone', 'ipad', 'ipod', 
-        'blackberry', 'windows phone', 'webos'
-    ]
-    
-    # Tablet indicators
-    tablet_keywords = ['tablet', 'ipad', 'playbook', 'silk']
+    if TABLET_UA_RE.search(user_agent):
+        return True, 'tablet'
     
-    # Check tablet first (more specific)
-    for keyword in tablet_keywords:
-        if keyword in user_agent:
-            return True, 'tablet'
-    
-    # Check mobile
-    for keyword in mobile_keywords:
-        if keyword in user_agent:
-            return True, 'mobile'
+    if MOBILE_UA_RE.search(user_agent):
+        return True, 'mobile'
     
     return False, 'desktop'
 
@@ -86,15 +85,15 @@ def check_device_compatibility(request, test_id):
             ip_address=get_client_ip(request)
         )
         
-        ProctoringEvent.objects.create(
-            attempt=attempt,
-            event_type='mobile_device_blocked',
-            severity='warning',
+        ProctoringEvent.buffer_create(
+            attempt,
+            'mobile_device_blocked',
             metadata={
                 'device_type': device_type,
                 'user_agent': user_agent,
                 'ip_address': get_client_ip(request)
-            }
+            },
+            severity='warning'
         )
         
         return render(request, 'assessment/device_blocked.html', {
@@ -109,15 +108,26 @@ def check_device_compatibility(request, test_id):
 
 # ============ FACE VERIFICATION ============
 
-def calculate_blur_score(image_array):
+# Face detection runs on frames downscaled to this shortest edge
+FACE_DETECTION_SHORT_EDGE = 480
+
+try:
+    FACE_CASCADE = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+except AttributeError:
+    # OpenCV 5 moved Haar cascades out of the main package; HOG alone is used
+    FACE_CASCADE = None
+
+
+def calculate_blur_score(image_bgr):
     """
-    Calculate blur score using Laplacian variance
+    Calculate blur score using Laplacian variance of a BGR image
     Higher score = sharper image
     Score < 50 typically means blurry
     """
-    gray = cv2.cvtColor(image_array, cv2.COLOR_RGB2GRAY)
-    laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
-    return laplacian_var
+    gray = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY)
+    # float32 gives the same variance as CV_64F at half the memory traffic
+    _, stddev = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_32F))
+    return float(stddev[0, 0]) ** 2
 
 
 def verify_face_clarity(image_file):
@@ -132,18 +142,41 @@ def verify_face_clarity(image_file):
         return True, "Face verification disabled", {'skipped': True}
     
     try:
-        # Load image
-        img = Image.open(image_file)
-        img_array = np.array(img)
+        # Decode straight to 3-channel BGR (grayscale/alpha inputs included)
+        img_bgr = cv2.imdecode(np.frombuffer(image_file.read(), np.uint8), cv2.IMREAD_COLOR)
+        image_file.seek(0)
+        if img_bgr is None:
+            raise ValueError("Unreadable image")
+        # HOG cost grows with pixel count; detect on a copy whose short edge is
+        # FACE_DETECTION_SHORT_EDGE and map the boxes back to full resolution
+        height, width = img_bgr.shape[:2]
+        scale = min(1.0, FACE_DETECTION_SHORT_EDGE / min(height, width))
+        small_bgr = img_bgr if scale == 1.0 else cv2.resize(
+            img_bgr, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+        )
         
-        # Convert to RGB if needed
-        if len(img_array.shape) == 2:  # Grayscale
-            img_array = cv2.cvtColor(img_array, cv2.COLOR_GRAY2RGB)
-        elif img_array.shape[2] == 4:  # RGBA
-            img_array = cv2.cvtColor(img_array, cv2.COLOR_RGBA2RGB)
+        min_size = getattr(settings, 'MIN_FACE_SIZE_PIXELS', 100)
         
-        # 1. Detect faces
-        face_locations = face_recognition.face_locations(img_array, model='hog')
+        # 1. Detect faces: a Haar cascade settles the common single-face case;
+        # dlib HOG only runs when it finds no face or several. minSize skips
+        # the finest (most expensive) pyramid levels; it is half the required
+        # face size so a smaller second face still fails the multiple-faces check
+        min_window = max(1, round(min_size * scale / 2))
+        faces = () if FACE_CASCADE is None else FACE_CASCADE.detectMultiScale(
+            cv2.cvtColor(small_bgr, cv2.COLOR_BGR2GRAY), scaleFactor=1.2, minNeighbors=5,
+            minSize=(min_window, min_window)
+        )
+        if len(faces) == 1:
+            x, y, w, h = faces[0]
+            small_locations = [(y, x + w, y + h, x)]
+        else:
+            # face_recognition expects RGB
+            small_rgb = cv2.cvtColor(small_bgr, cv2.COLOR_BGR2RGB)
+            small_locations = face_recognition.face_locations(small_rgb, model='hog')
+        face_locations = [
+            tuple(round(int(coordinate) / scale) for coordinate in location)
+            for location in small_locations
+        ]
         
         if len(face_locations) == 0:
             return False, "No face detected. Please position yourself clearly in front of the camera.", {
@@ -161,7 +194,6 @@ def verify_face_clarity(image_file):
         top, right, bottom, left = face_locations[0]
         face_width = right - left
         face_height = bottom - top
-        min_size = getattr(settings, 'MIN_FACE_SIZE_PIXELS', 100)
         
         if face_width < min_size or face_height < min_size:
             return False, "Face too small. Please move closer to the camera.", {
@@ -172,7 +204,7 @@ def verify_face_clarity(image_file):
             }
         
         # 3. Check blur/clarity
-        blur_score = calculate_blur_score(img_array)
+        blur_score = calculate_blur_score(img_bgr)
         min_clarity = getattr(settings, 'MIN_FACE_CLARITY_SCORE', 50)
         
         if blur_score < min_clarity:
@@ -267,18 +299,6 @@ def upload_proctoring_snapshot(request, attempt_id):
         return JsonResponse({'error': 'No snapshot provided'}, status=400)
     
     try:
-            # Compress image
-            img = Image.open(snapshot_file)
-            if img.mode in ('RGBA', 'P'):
-                img = img.convert('RGB')
-            
-            max_size = (640, 480)
-            img.thumbnail(max_size, Image.Resampling.LANCZOS)
-            
-            output = BytesIO()
-            img.save(output, format='JPEG', quality=70, optimize=True)
-            output.seek(0)
-            
             # Parse event metadata if present
             event_metadata = None
             if event_metadata_json:
@@ -295,32 +315,43 @@ def upload_proctoring_snapshot(request, attempt_id):
                 else:
                     severity = 'warning'  # Default for event screenshots
             
-            # Create proctoring event
-            event = ProctoringEvent.objects.create(
+            # Build the event with its final metadata; saved once with the image
+            event = ProctoringEvent(
                 attempt=attempt,
                 event_type=snapshot_type,
                 severity=severity,
                 is_event_screenshot=is_event_screenshot,
-                event_metadata=event_metadata,
                 metadata={
                     'original_size': snapshot_file.size,
-                    'compressed_size': output.tell(),
                     'user_agent': request.META.get('HTTP_USER_AGENT', ''),
                     'ip_address': get_client_ip(request),
-                    'is_event': is_event_screenshot
+                    'is_event': is_event_screenshot,
+                    'event_metadata': event_metadata,
                 }
             )
             
-            # Save compressed image
-            filename = f"{snapshot_type}_{attempt.user.id}_{timezone.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-            event.image_file.save(filename, ContentFile(output.read()), save=True)
+            # Random suffix: per-second timestamps collided under concurrent uploads,
+            # making the storage backend retry with new names
+            filename = f"{snapshot_type}_{attempt.user_id}_{attempt.id}_{uuid.uuid4().hex[:12]}.jpg"
+            compress_async = getattr(settings, 'PROCTORING_ASYNC_SNAPSHOT_COMPRESSION', False)
+            if compress_async:
+                # Store the upload as is; a Celery worker compresses it
+                event.metadata['compression_pending'] = True
+                raw_suffix = Path(snapshot_file.name).suffix.lower() or '.bin'
+                event.image_file.save(filename.replace('.jpg', f'_raw{raw_suffix}'), snapshot_file, save=True)
+                compress_proctoring_snapshot.delay(event.id, filename)
+            else:
+                data = ProctoringEvent.compress_snapshot(snapshot_file)
+                event.metadata['compressed_size'] = len(data)
+                event.image_file.save(filename, ContentFile(data), save=True)
             
             return JsonResponse({
                 'success': True,
                 'event_id': event.id,
                 'is_event_screenshot': is_event_screenshot,
-                'severity': severity
-            })
+                'severity': severity,
+                'compression_pending': compress_async
+            }, status=202 if compress_async else 200)
             
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
@@ -352,29 +383,27 @@ def log_proctoring_event(request, attempt_id):
         # Determine severity
         severity = determine_event_severity(event_type, metadata)
         
-        # Special handling for IP logging
+        # Special handling for IP logging (conditional UPDATEs so concurrent
+        # events on the same attempt don't race)
         if event_type == 'ip_logged' and 'ip' in metadata:
-            if not attempt.ip_address:
-                attempt.ip_address = metadata['ip']
-                attempt.save(update_fields=['ip_address'])
+            TestAttempt.objects.filter(
+                pk=attempt.pk, ip_address__isnull=True
+            ).update(ip_address=metadata['ip'])
         
         # Special handling for camera disabled
         if event_type == 'camera_disabled':
-            attempt.status = 'flagged'
-            attempt.save(update_fields=['status'])
+            TestAttempt.objects.filter(pk=attempt.pk).exclude(
+                status='flagged'
+            ).update(status='flagged')
         
-        # Create event
-        event = ProctoringEvent.objects.create(
-            attempt=attempt,
-            event_type=event_type,
-            severity=severity,
-            metadata=metadata
-        )
+        # Create event (non-critical events may be queued for a bulk insert)
+        event = ProctoringEvent.buffer_create(attempt, event_type, metadata, severity)
         
         return JsonResponse({
             'success': True, 
-            'event_id': event.id,
-            'severity': severity
+            'event_id': event.id if event else None,
+            'severity': severity,
+            'buffered': event is None
         })
         
     except json.JSONDecodeError:
@@ -414,32 +443,34 @@ def test_consent_form(request, test_id):
         
         if consent_given and face_verified:
             # Update attempt with consent data
+            now = timezone.now()
             attempt.consent_given = True
-            attempt.consent_timestamp = timezone.now()
+            attempt.consent_timestamp = now
             attempt.status = 'in_progress'
-            attempt.started_at = timezone.now()
+            attempt.started_at = now
             
-            attempt.save()
+            attempt.save(update_fields=[
+                'consent_given', 'consent_timestamp', 'status', 'started_at', 'expires_at'
+            ])
             
             # Log consent acceptance as proctoring event
-            ProctoringEvent.objects.create(
-                attempt=attempt,
-                event_type='consent_accepted',
-                severity='info',
+            ProctoringEvent.buffer_create(
+                attempt,
+                'consent_accepted',
                 metadata={
                     'ip_address': attempt.ip_address,
                     'user_agent': attempt.user_agent,
-                    'consent_timestamp': timezone.now().isoformat(),
+                    'consent_timestamp': now.isoformat(),
                     'face_verified': True,
-                    'test_start_time': timezone.now().isoformat()
+                    'test_start_time': now.isoformat()
                 }
             )
             
             # Generate random question set if auto-generate enabled
             if test.auto_generate_from_topics:
-                questions = test.generate_question_set()
-                attempt.question_set = [q.id for q in questions]
-                attempt.save()
+                attempt.question_ids = test.generate_question_set()
+                attempt.save(update_fields=['question_set_packed'])
+                attempt.create_blank_answers(attempt.question_ids)
             
             messages.success(request, 'Consent accepted. You may now begin the test.')
             
@@ -495,38 +526,39 @@ def get_client_ip(request):
     return ip
 
 
+CRITICAL_EVENTS = frozenset({
+    'camera_disabled',
+    'camera_permission_denied',
+    'face_verification_failed',
+    'no_face_detected',
+})
+
+WARNING_EVENTS = frozenset({
+    'tab_switched',
+    'fullscreen_exit',
+    'window_blur',
+    'copy_paste_blocked',
+    'event_tab_switch',
+    'event_window_blur',
+    'event_fullscreen_exit',
+    'event_copy_paste_attempt',
+})
+
+
 def determine_event_severity(event_type, metadata):
     """
     UPDATED: Enhanced severity determination with away time consideration
     """
-    critical_events = [
-        'camera_disabled',
-        'camera_permission_denied',
-        'face_verification_failed',
-        'no_face_detected',
-    ]
-    
-    warning_events = [
-        'tab_switched',
-        'fullscreen_exit',
-        'window_blur',
-        'copy_paste_blocked',
-        'event_tab_switch',
-        'event_window_blur',
-        'event_fullscreen_exit',
-        'event_copy_paste_attempt',
-    ]
-    
     # Check explicit severity
     if 'severity' in metadata:
         return metadata['severity']
     
     # Critical events
-    if event_type in critical_events:
+    if event_type in CRITICAL_EVENTS:
         return 'critical'
     
     # Warning events with escalation
-    if event_type in warning_events:
+    if event_type in WARNING_EVENTS:
         warning_count = metadata.get('warning_count', 0)
         away_time = metadata.get('away_time_seconds', 0)
         
@@ -545,37 +577,35 @@ def view_candidate_images(request, attempt_id):
     """
     attempt = get_object_or_404(TestAttempt, id=attempt_id)
     
+    # Lists rather than querysets: each is rendered and counted, so fetch once
     # Get periodic snapshots
-    webcam_images = attempt.proctoring_events.filter(
+    webcam_images = list(attempt.proctoring_events.filter(
         event_type='webcam',
         image_file__isnull=False
-    ).order_by('timestamp')
+    ).order_by('timestamp'))
     
-    screen_images = attempt.proctoring_events.filter(
+    screen_images = list(attempt.proctoring_events.filter(
         event_type='screen',
         image_file__isnull=False
-    ).order_by('timestamp')
+    ).order_by('timestamp'))
     
-    # NEW: Get event-triggered screenshots
-    event_screenshots = attempt.proctoring_events.filter(
+    # NEW: Get event-triggered screenshots (only counted on this page)
+    event_screenshot_count = attempt.proctoring_events.filter(
         is_event_screenshot=True,
         image_file__isnull=False
-    ).order_by('timestamp')
+    ).count()
     
     # Get critical events
-    critical_events = attempt.proctoring_events.filter(
+    critical_events = list(attempt.proctoring_events.filter(
         severity='critical'
-    ).order_by('timestamp')
+    ).order_by('timestamp'))
     
-    # NEW: Get away time summary
-    away_events = attempt.proctoring_events.filter(
+    # NEW: Get away time summary (summed in the database)
+    total_away_time = attempt.proctoring_events.filter(
         event_type__in=['tab_returned', 'window_focus_returned']
-    )
-    total_away_time = sum([
-        e.metadata.get('away_time_seconds', 0) 
-        for e in away_events 
-        if e.metadata
-    ])
+    ).aggregate(
+        total=Sum(Cast(KeyTextTransform('away_time_seconds', 'metadata'), FloatField()))
+    )['total'] or 0
     
     context = {
         'attempt': attempt,
@@ -583,9 +613,8 @@ def view_candidate_images(request, attempt_id):
         'test': attempt.test,
         'webcam_images': webcam_images,
         'screen_images': screen_images,
-        'event_screenshots': event_screenshots,
         'critical_events': critical_events,
-        'total_images': webcam_images.count() + screen_images.count() + event_screenshots.count(),
+        'total_images': len(webcam_images) + len(screen_images) + event_screenshot_count,
         'total_away_time_minutes': round(total_away_time / 60, 1),
     }
     
@@ -0,0 +1,64 @@
+"""
+Bulk scoring kernels for the assessment app
+Used when re-grading many answers at once (see Answer.recheck_hotspots_bulk)
+"""
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+def _hotspot_hits_numpy(cx, cy, regions, starts, counts):
+    """Broadcast every click against its own block of regions"""
+    hits = np.zeros(len(cx), dtype=bool)
+    has_regions = counts > 0
+    if not has_regions.any():
+        return hits
+
+    block_counts = counts[has_regions]
+    block_starts = starts[has_regions]
+    # Offset of each click's first comparison in the flattened arrays
+    group_starts = np.cumsum(block_counts) - block_counts
+
+    clicks = np.repeat(np.nonzero(has_regions)[0], block_counts)
+    rows = np.repeat(block_starts - group_starts, block_counts) + np.arange(block_counts.sum())
+    x, y, w, h = regions[rows].T
+    px, py = cx[clicks], cy[clicks]
+
+    inside = (x <= px) & (px <= x + w) & (y <= py) & (py <= y + h)
+    hits[has_regions] = np.logical_or.reduceat(inside, group_starts)
+    return hits
+
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _hotspot_hits_numba(cx, cy, regions, starts, counts):
+        hits = np.zeros(cx.shape[0], dtype=np.bool_)
+        for i in range(cx.shape[0]):
+            for j in range(starts[i], starts[i] + counts[i]):
+                x, y, w, h = regions[j, 0], regions[j, 1], regions[j, 2], regions[j, 3]
+                if x <= cx[i] <= x + w and y <= cy[i] <= y + h:
+                    hits[i] = True
+                    break
+        return hits
+
+
+def hotspot_hits(cx, cy, regions, starts, counts):
+    """
+    Test many clicks against hotspot regions in one call.
+
+    Args:
+        cx, cy: float arrays of click coordinates (NaN never hits)
+        regions: (M, 4) float array of x, y, width, height rows
+        starts, counts: int arrays; click i is tested against
+            regions[starts[i]:starts[i] + counts[i]]
+
+    Returns:
+        Bool array, True where the click falls inside any of its regions
+    """
+    if NUMBA_AVAILABLE:
+        return _hotspot_hits_numba(cx, cy, regions, starts, counts)
+    return _hotspot_hits_numpy(cx, cy, regions, starts, counts)
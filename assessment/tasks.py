@@ -0,0 +1,39 @@
+"""
+Celery tasks for the assessment app
+"""
+from celery import shared_task
+
+from assessment.models import PlagiarismFlag, ProctoringEvent, TestAttempt, TestStats
+from assessment.proctoring_buffer import event_buffer
+
+
+@shared_task
+def refresh_test_stats():
+    """Refresh the materialized per-test pass-rate aggregates"""
+    TestStats.refresh()
+
+
+@shared_task
+def flush_proctoring_events(attempt_id=None):
+    """Bulk-insert proctoring events queued by the event buffer"""
+    return event_buffer.flush(attempt_id)
+
+
+@shared_task
+def compress_proctoring_snapshot(event_id, filename):
+    """Compress a raw snapshot stored by upload_proctoring_snapshot"""
+    event = ProctoringEvent.objects.filter(pk=event_id).first()
+    if event is not None and event.image_file:
+        event.compress_image_file(filename)
+
+
+@shared_task
+def expire_stale_attempts():
+    """Expire running attempts whose time limit has passed"""
+    return TestAttempt.expire_stale()
+
+
+@shared_task
+def detect_plagiarism():
+    """Flag completed attempts from the last day that share too many answers"""
+    return PlagiarismFlag.detect()
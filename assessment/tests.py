@@ -1,3 +1,720 @@
-from django.test import TestCase
+import io
+import itertools
+import json
+import random
+from collections import Counter
+from datetime import date, timedelta
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+import numpy as np
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import scoring
+from .models import (
+    PASSED_TRIGGER_SQL, PROFILE_COMPLETE_FLAGS, PROFILE_REQUIRED_FIELDS,
+    QUESTIONS_VERSION_KEY, TEST_STATS_VIEW_SQL, Answer, PlagiarismFlag,
+    ProctoringEvent, Question, QuestionTopic, Test, TestAttempt, TestCategory,
+    TestStats, TestTopicDistribution, UserProfile, question_cache_is_shared,
+    reservoir_sample
+)
+from .utils import create_test_attempts_bulk
+
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class AssessmentTestCase(TestCase):
+    """Shared fixture: one category/topic with four MCQs worth 1-4 points and a test"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = TestCategory.objects.create(name='Reasoning', description='d', stage_number=1)
+        cls.topic = QuestionTopic.objects.create(category=cls.category, name='Verbal', questions_per_test=4)
+        cls.questions = [
+            Question.objects.create(
+                topic=cls.topic, question_text=f'Q{i}', correct_answer='a', points=points
+            )
+            for i, points in enumerate([1, 2, 3, 4])
+        ]
+        cls.test = Test.objects.create(
+            category=cls.category, title='Stage 1', description='d', passing_score=50
+        )
+        cls.user = User.objects.create_user('candidate')
+
+    def make_attempt(self, answers, user=None, **kwargs):
+        """Create an attempt answering questions[i] with answers[i] (None = blank)"""
+        attempt = TestAttempt.objects.create(
+            user=user or self.user, test=self.test, started_at=timezone.now(), **kwargs
+        )
+        for question, selected in zip(self.questions, answers):
+            Answer.objects.create(attempt=attempt, question=question, selected_answer=selected)
+        return attempt
+
+
+class FinalizeTests(AssessmentTestCase):
+    def test_scores_in_a_single_query(self):
+        attempt = self.make_attempt(['a', 'b', 'a', 'b'])
+        Answer.check_answers_bulk(attempt)
+
+        with self.assertNumQueries(1):
+            score, passed = TestAttempt.finalize(attempt.pk)
+
+        # 1 + 3 of 10 points
+        self.assertEqual(float(score), 40.0)
+        self.assertFalse(passed)
+        attempt.refresh_from_db()
+        self.assertEqual(float(attempt.score), 40.0)
+        self.assertFalse(attempt.passed)
+
+    def test_attempt_without_answers_scores_zero(self):
+        attempt = TestAttempt.objects.create(user=self.user, test=self.test)
+        score, passed = TestAttempt.finalize(attempt.pk)
+        self.assertEqual(float(score), 0.0)
+        self.assertFalse(passed)
+
+
+@skipUnless(connection.vendor in PASSED_TRIGGER_SQL, 'No passed trigger for this backend')
+class PassedTriggerTests(AssessmentTestCase):
+    def test_passed_follows_score(self):
+        attempt = TestAttempt.objects.create(user=self.user, test=self.test)
+        self.assertIsNone(TestAttempt.objects.get(pk=attempt.pk).passed)
+
+        TestAttempt.objects.filter(pk=attempt.pk).update(score=50)
+        self.assertTrue(TestAttempt.objects.get(pk=attempt.pk).passed)
+
+        TestAttempt.objects.filter(pk=attempt.pk).update(score=49.99)
+        self.assertFalse(TestAttempt.objects.get(pk=attempt.pk).passed)
+
+        TestAttempt.objects.filter(pk=attempt.pk).update(score=None)
+        self.assertIsNone(TestAttempt.objects.get(pk=attempt.pk).passed)
+
+    def test_calculate_score_sets_passed(self):
+        attempt = self.make_attempt(['a', 'a', 'a', 'b'])
+        Answer.check_answers_bulk(attempt)
+        self.assertEqual(attempt.calculate_score(), 60.0)
+        self.assertTrue(attempt.passed)
+
+
+class ReservoirSampleTests(TestCase):
+    def test_short_input_is_returned_whole(self):
+        self.assertEqual(reservoir_sample(range(3), 5), [0, 1, 2])
+        self.assertEqual(reservoir_sample(range(3), 0), [])
+
+    def test_sample_has_k_distinct_items(self):
+        sample = reservoir_sample(iter(range(1000)), 10)
+        self.assertEqual(len(sample), 10)
+        self.assertEqual(len(set(sample)), 10)
+        self.assertTrue(all(0 <= item < 1000 for item in sample))
+
+    def test_every_item_is_equally_likely(self):
+        random.seed(1234)
+        runs = 3000
+        counts = Counter()
+        for _ in range(runs):
+            counts.update(reservoir_sample(range(10), 3))
+        # Each item is expected runs * 3/10 = 900 times
+        for item in range(10):
+            self.assertAlmostEqual(counts[item], 900, delta=120)
+
+
+class BulkCheckChoicesTests(AssessmentTestCase):
+    def test_grades_choice_answers_in_one_update(self):
+        attempt = self.make_attempt(['a', 'b', None])
+        dicom = Question.objects.create(
+            topic=self.topic, question_text='Click', question_type='dicom',
+            hotspot_coordinates=[{'x': 0, 'y': 0, 'width': 10, 'height': 10}]
+        )
+        Answer.objects.create(attempt=attempt, question=dicom, clicked_coordinates={'x': 5, 'y': 5})
+
+        with self.assertNumQueries(1):
+            self.assertEqual(Answer.bulk_check_choices(attempt), 3)
+
+        graded = dict(attempt.answers.values_list('question_id', 'is_correct'))
+        self.assertEqual(
+            [graded[q.pk] for q in self.questions[:3]], [True, False, False]
+        )
+        # Non-choice answers are left for check_answers_bulk
+        self.assertIsNone(graded[dicom.pk])
+        Answer.check_answers_bulk(attempt)
+        self.assertTrue(attempt.answers.get(question=dicom).is_correct)
+
+    def test_graded_answers_are_not_regraded(self):
+        attempt = self.make_attempt(['b'])
+        attempt.answers.update(is_correct=True)
+        self.assertEqual(Answer.bulk_check_choices(attempt), 0)
+        self.assertTrue(attempt.answers.get().is_correct)
+
+
+class CompressSnapshotTests(TestCase):
+    def encode(self, size, fmt):
+        image = Image.new('RGB', size)
+        # A gradient so the encoder has real content to work with
+        image.putdata([(x % 256, y % 256, (x + y) % 256) for y in range(size[1]) for x in range(size[0])])
+        output = io.BytesIO()
+        image.save(output, format=fmt)
+        output.seek(0)
+        return output
+
+    def test_large_snapshot_is_downscaled_to_jpeg(self):
+        data = ProctoringEvent.compress_snapshot(self.encode((1280, 720), 'PNG'))
+        image = Image.open(io.BytesIO(data))
+        self.assertEqual(image.format, 'JPEG')
+        self.assertEqual(image.size, (640, 360))
+
+    def test_small_jpeg_is_stored_as_is(self):
+        upload = self.encode((320, 240), 'JPEG')
+        original = upload.getvalue()
+        self.assertEqual(ProctoringEvent.compress_snapshot(upload), original)
+
+    def test_small_png_is_reencoded_without_upscaling(self):
+        data = ProctoringEvent.compress_snapshot(self.encode((320, 240), 'PNG'))
+        image = Image.open(io.BytesIO(data))
+        self.assertEqual((image.format, image.size), ('JPEG', (320, 240)))
+
+
+@skipIf(fakeredis is None, 'fakeredis is not installed')
+@override_settings(PROCTORING_EVENT_BUFFERING=True)
+class ProctoringEventBufferTests(AssessmentTestCase):
+    def setUp(self):
+        from .proctoring_buffer import ProctoringEventBuffer
+        self.buffer = ProctoringEventBuffer()
+        self.buffer._client = fakeredis.FakeRedis()
+        self.attempt = TestAttempt.objects.create(user=self.user, test=self.test)
+
+    def test_flush_writes_queued_events_with_their_queue_time(self):
+        queued_at = timezone.now() - timedelta(minutes=5)
+        with mock.patch('assessment.proctoring_buffer.timezone.now', return_value=queued_at):
+            self.assertTrue(self.buffer.append(self.attempt.pk, 'tab_switched', 'warning', {'n': 1}))
+        self.assertTrue(self.buffer.append(self.attempt.pk, 'window_blur', 'warning', {}))
+        self.assertEqual(ProctoringEvent.objects.count(), 0)
+
+        with self.assertNumQueries(4):  # attempt lookup, savepoint, INSERT, release
+            self.assertEqual(self.buffer.flush(), 2)
+
+        event = ProctoringEvent.objects.get(event_type='tab_switched')
+        self.assertEqual(event.timestamp, queued_at)
+        self.assertEqual(event.metadata, {'n': 1})
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_failed_batch_is_dead_lettered_and_others_still_flush(self):
+        from .proctoring_buffer import DEAD_LETTER_KEY
+        self.buffer.append(self.attempt.pk, 'tab_switched', 'warning', {})
+        # Attempt deleted after its event was queued
+        missing_id = self.attempt.pk + 1000
+        self.buffer.append(missing_id, 'tab_switched', 'warning', {})
+
+        with self.assertLogs('assessment.proctoring_buffer', 'WARNING'):
+            self.assertEqual(self.buffer.flush(), 1)
+
+        self.assertEqual(ProctoringEvent.objects.get().attempt_id, self.attempt.pk)
+        dead = [json.loads(raw) for raw in self.buffer.client.lrange(DEAD_LETTER_KEY, 0, -1)]
+        self.assertEqual([event['attempt_id'] for event in dead], [missing_id])
+        self.assertFalse(self.buffer.client.smembers('proctoring:events:pending'))
+
+
+class PlagiarismDetectTests(AssessmentTestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.original = self.make_attempt(['a', 'b', 'c', 'd'], status='completed', completed_at=now)
+        self.copy = self.make_attempt(
+            ['a', 'b', 'c', 'd'], user=User.objects.create_user('copier'),
+            status='completed', completed_at=now
+        )
+        self.other = self.make_attempt(
+            ['a', 'x', 'y', 'z'], user=User.objects.create_user('honest'),
+            status='completed', completed_at=now
+        )
+
+    def test_flags_identical_attempts_once(self):
+        self.assertEqual(PlagiarismFlag.detect(min_matches=4, threshold=90), 1)
+        flag = PlagiarismFlag.objects.get()
+        self.assertEqual((flag.attempt1_id, flag.attempt2_id), (self.original.pk, self.copy.pk))
+        self.assertEqual(flag.similarity_percentage, 100.0)
+        self.assertEqual(flag.matching_answers, [q.pk for q in self.questions])
+        self.assertTrue(TestAttempt.objects.get(pk=self.copy.pk).flagged_for_plagiarism)
+        self.assertFalse(TestAttempt.objects.get(pk=self.other.pk).flagged_for_plagiarism)
+
+        # Already flagged pairs are not counted again
+        self.assertEqual(PlagiarismFlag.detect(min_matches=4, threshold=90), 0)
+        self.assertEqual(PlagiarismFlag.objects.count(), 1)
+
+    def test_explicit_zero_threshold_is_honoured(self):
+        # Every pair shares at least the first answer
+        self.assertEqual(PlagiarismFlag.detect(min_matches=1, threshold=0), 3)
+
+    def test_only_new_pairs_are_counted(self):
+        self.assertEqual(PlagiarismFlag.detect(min_matches=4, threshold=90), 1)
+        self.assertEqual(PlagiarismFlag.detect(min_matches=1, threshold=0), 2)
+        self.assertEqual(PlagiarismFlag.objects.count(), 3)
+
+    def test_old_attempts_are_skipped(self):
+        TestAttempt.objects.update(completed_at=timezone.now() - timedelta(days=3))
+        self.assertEqual(PlagiarismFlag.detect(min_matches=1, threshold=0), 0)
+
+
+class SubmitAnswerTests(AssessmentTestCase):
+    def test_answering_a_blank_row_refreshes_answered_at(self):
+        attempt = self.make_attempt([None])
+        blank = attempt.answers.get()
+        assigned_at = blank.answered_at
+
+        answered_at = assigned_at + timedelta(minutes=10)
+        self.client.force_login(self.user)
+        with mock.patch('assessment.views.timezone.now', return_value=answered_at):
+            response = self.client.post(
+                reverse('submit_answer', args=[attempt.pk]),
+                {'question_id': self.questions[0].pk, 'answer': 'a'}
+            )
+
+        self.assertEqual(response.status_code, 200)
+        blank.refresh_from_db()
+        self.assertEqual(blank.selected_answer, 'a')
+        self.assertEqual(blank.answered_at, answered_at)
+
+
+class AttemptDeadlineTests(AssessmentTestCase):
+    def time_limit(self):
+        return timedelta(minutes=self.test.time_limit_minutes)
+
+    def test_bulk_created_attempts_get_a_deadline(self):
+        [attempt] = create_test_attempts_bulk(self.test, [self.user])
+        attempt = TestAttempt.objects.get(pk=attempt.pk)
+        self.assertEqual(attempt.status, 'started')
+        self.assertEqual(attempt.expires_at, attempt.started_at + self.time_limit())
+
+    def test_consent_recomputes_the_deadline(self):
+        [attempt] = create_test_attempts_bulk(self.test, [self.user])
+        # Assigned long before the candidate got round to consenting
+        assigned_at = timezone.now() - self.time_limit() * 3
+        TestAttempt.objects.filter(pk=attempt.pk).update(
+            started_at=assigned_at, expires_at=assigned_at + self.time_limit()
+        )
+
+        attempt = TestAttempt.objects.get(pk=attempt.pk)
+        now = timezone.now()
+        attempt.status = 'in_progress'
+        attempt.started_at = now
+        # expires_at is written even when the caller does not list it
+        attempt.save(update_fields=['status', 'started_at'])
+
+        attempt = TestAttempt.objects.get(pk=attempt.pk)
+        self.assertEqual(attempt.expires_at, now + self.time_limit())
+        self.assertFalse(attempt.is_expired())
+        self.assertEqual(TestAttempt.expire_stale(), 0)
+
+    def test_unchanged_start_keeps_the_deadline(self):
+        attempt = TestAttempt.objects.create(
+            user=self.user, test=self.test, started_at=timezone.now()
+        )
+        deadline = timezone.now() + timedelta(days=1)
+        TestAttempt.objects.filter(pk=attempt.pk).update(expires_at=deadline)
+
+        attempt = TestAttempt.objects.get(pk=attempt.pk)
+        attempt.time_spent_seconds = 30
+        attempt.save()
+        self.assertEqual(TestAttempt.objects.get(pk=attempt.pk).expires_at, deadline)
+
+    def test_expire_stale_skips_attempts_awaiting_consent(self):
+        past = timezone.now() - self.time_limit() * 2
+        waiting = TestAttempt.objects.create(
+            user=self.user, test=self.test, status='started', started_at=past
+        )
+        running = TestAttempt.objects.create(
+            user=self.user, test=self.test, status='in_progress', started_at=past
+        )
+
+        self.assertEqual(TestAttempt.expire_stale(), 1)
+        self.assertEqual(TestAttempt.objects.get(pk=waiting.pk).status, 'started')
+        self.assertEqual(TestAttempt.objects.get(pk=running.pk).status, 'expired')
+
+
+class TotalQuestionsTests(AssessmentTestCase):
+    def test_cached_total_is_used_even_when_zero(self):
+        Test.objects.filter(pk=self.test.pk).update(total_questions_cached=0)
+        test = Test.objects.get(pk=self.test.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(test.total_questions, 0)
+            self.assertEqual(test.get_total_questions(), 0)
+
+    def test_missing_total_falls_back_to_the_topics(self):
+        Test.objects.filter(pk=self.test.pk).update(total_questions_cached=None)
+        test = Test.objects.get(pk=self.test.pk)
+        self.assertEqual(test.total_questions, 4)
+        # Memoized on the instance
+        with self.assertNumQueries(0):
+            self.assertEqual(test.total_questions, 4)
+
+
+class QuestionIdCacheTests(AssessmentTestCase):
+    def test_only_shared_backends_are_trusted(self):
+        for backend, shared in [
+            ('django.core.cache.backends.locmem.LocMemCache', False),
+            ('django.core.cache.backends.dummy.DummyCache', False),
+            ('django.core.cache.backends.filebased.FileBasedCache', False),
+            ('django.core.cache.backends.db.DatabaseCache', True),
+            ('django.core.cache.backends.redis.RedisCache', True),
+        ]:
+            with self.subTest(backend=backend), override_settings(
+                CACHES={'default': {'BACKEND': backend, 'LOCATION': 'anno-tests'}}
+            ):
+                self.assertIs(question_cache_is_shared(), shared)
+
+    def test_local_cache_reads_the_database(self):
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                ids = QuestionTopic.get_active_question_ids([self.topic.pk])
+        self.assertCountEqual(ids[self.topic.pk], [q.pk for q in self.questions])
+
+    @mock.patch('assessment.models.question_cache_is_shared', return_value=True)
+    def test_ids_are_cached_until_a_question_changes(self, _shared):
+        cache.clear()
+        with self.assertNumQueries(1):
+            QuestionTopic.get_active_question_ids([self.topic.pk])
+        with self.assertNumQueries(0):
+            ids = QuestionTopic.get_active_question_ids([self.topic.pk])
+        self.assertCountEqual(ids[self.topic.pk], [q.pk for q in self.questions])
+
+        # Saving a question bumps the version, so the next read reloads
+        added = Question.objects.create(topic=self.topic, question_text='Q4', correct_answer='a')
+        with self.assertNumQueries(1):
+            ids = QuestionTopic.get_active_question_ids([self.topic.pk])
+        self.assertIn(added.pk, ids[self.topic.pk])
+
+    @mock.patch('assessment.models.question_cache_is_shared', return_value=True)
+    def test_evicted_version_starts_fresh(self, _shared):
+        cache.clear()
+        QuestionTopic.get_active_question_ids([self.topic.pk])
+        cache.delete(QUESTIONS_VERSION_KEY)
+        added = Question.objects.create(topic=self.topic, question_text='Q4', correct_answer='a')
+        self.assertIsNotNone(cache.get(QUESTIONS_VERSION_KEY))
+        self.assertIn(added.pk, QuestionTopic.get_active_question_ids([self.topic.pk])[self.topic.pk])
+
+
+class TotalQuestionsCachedTests(AssessmentTestCase):
+    def cached_total(self):
+        return Test.objects.values_list('total_questions_cached', flat=True).get(pk=self.test.pk)
+
+    def test_new_test_caches_its_category_total(self):
+        self.assertEqual(self.cached_total(), 4)
+
+    def test_distributions_override_the_category_total(self):
+        other = QuestionTopic.objects.create(category=self.category, name='Numerical')
+        first = TestTopicDistribution.objects.create(test=self.test, topic=self.topic, num_questions=2)
+        TestTopicDistribution.objects.create(test=self.test, topic=other, num_questions=3)
+        self.assertEqual(self.cached_total(), 5)
+
+        first.num_questions = 1
+        first.save()
+        self.assertEqual(self.cached_total(), 4)
+
+        # With the last distribution gone the test samples the whole category again
+        self.test.topic_distributions.all().delete()
+        self.assertEqual(self.cached_total(), 4 + other.questions_per_test)
+
+    def test_topic_changes_reach_category_wide_tests(self):
+        self.topic.questions_per_test = 6
+        self.topic.save()
+        self.assertEqual(self.cached_total(), 6)
+
+        # Tests with their own distributions are left alone
+        TestTopicDistribution.objects.create(test=self.test, topic=self.topic, num_questions=2)
+        QuestionTopic.objects.create(category=self.category, name='Numerical', questions_per_test=5)
+        self.assertEqual(self.cached_total(), 2)
+
+    def test_save_recomputes_when_the_source_changes(self):
+        other = TestCategory.objects.create(name='Anatomy', description='d', stage_number=2)
+        QuestionTopic.objects.create(category=other, name='Brain', questions_per_test=7)
+
+        test = Test.objects.get(pk=self.test.pk)
+        test.category = other
+        test.save(update_fields=['category'])
+        self.assertEqual(self.cached_total(), 7)
+
+        test.auto_generate_from_topics = False
+        test.save()
+        self.assertEqual(self.cached_total(), 0)
+
+    def test_unrelated_save_keeps_the_cached_total(self):
+        Test.objects.filter(pk=self.test.pk).update(total_questions_cached=9)
+        test = Test.objects.get(pk=self.test.pk)
+        test.title = 'Renamed'
+        with self.assertNumQueries(1):
+            test.save()
+        self.assertEqual(self.cached_total(), 9)
+
+    def test_deleting_the_test_with_its_distributions(self):
+        TestTopicDistribution.objects.create(test=self.test, topic=self.topic, num_questions=2)
+        self.test.delete()
+        self.assertFalse(Test.objects.exists())
+
+
+@skipUnless(connection.vendor in TEST_STATS_VIEW_SQL, 'No test stats view for this backend')
+class TestStatsTests(AssessmentTestCase):
+    def setUp(self):
+        for score in [80, 50, 20]:
+            attempt = TestAttempt.objects.create(user=self.user, test=self.test)
+            TestAttempt.objects.filter(pk=attempt.pk).update(score=score, passed=score >= 50)
+        TestStats.refresh()
+
+    def test_counts_attempts_and_passes(self):
+        stats = TestStats.objects.get(test=self.test)
+        self.assertEqual((stats.total, stats.passed_count), (3, 2))
+        self.assertAlmostEqual(stats.pass_rate, 200 / 3)
+
+    def test_admin_columns_read_the_stats(self):
+        from .admin import TestAdmin
+        model_admin = TestAdmin(Test, admin.site)
+        request = RequestFactory().get('/')
+        request.user = User.objects.create_superuser('admin')
+
+        untaken = Test.objects.create(category=self.category, title='Stage 2', description='d')
+        with self.assertNumQueries(1):
+            tests = {test.pk: test for test in model_admin.get_queryset(request)}
+            self.assertEqual(model_admin.attempt_count(tests[self.test.pk]), 3)
+            self.assertEqual(model_admin.pass_rate(tests[self.test.pk]), '66.7%')
+            self.assertEqual(model_admin.attempt_count(tests[untaken.pk]), 0)
+            self.assertEqual(model_admin.pass_rate(tests[untaken.pk]), '-')
+
+    @skipIf(connection.vendor == 'postgresql', 'Refreshes a materialized view')
+    def test_refresh_is_a_no_op_for_plain_views(self):
+        with self.assertNumQueries(0):
+            TestStats.refresh()
+
+
+class ProfileCompletionTests(TestCase):
+    def setUp(self):
+        self.profile = User.objects.create_user('applicant').profile
+        self.profile.phone_number = '+263771234567'
+        self.profile.date_of_birth = date(1995, 5, 17)
+        self.profile.national_id = '63-123456-A-42'
+        self.profile.province = 'Harare'
+        self.profile.city = 'Harare'
+        self.profile.street_address = '1 Main Street'
+        self.profile.employment_status = 'employed'
+        self.profile.education_level = 'degree'
+        self.profile.terms_accepted = True
+        self.profile.data_processing_consent = True
+        self.profile.cv_document = 'cvs/applicant.pdf'
+
+    def test_complete_profile_sets_every_flag(self):
+        self.profile.save()
+        self.assertEqual(self.profile.completion_flags, PROFILE_COMPLETE_FLAGS)
+        self.assertTrue(self.profile.is_profile_complete())
+        self.assertTrue(UserProfile.objects.get(pk=self.profile.pk).profile_completed)
+
+    def test_missing_field_clears_its_bit(self):
+        # Whitespace-only text does not count as filled in
+        self.profile.city = '   '
+        self.profile.save()
+        bit = 1 << PROFILE_REQUIRED_FIELDS.index('city')
+        self.assertEqual(self.profile.completion_flags, PROFILE_COMPLETE_FLAGS & ~bit)
+        self.assertFalse(self.profile.profile_completed)
+        self.assertQuerySetEqual(
+            UserProfile.objects.exclude(completion_flags=PROFILE_COMPLETE_FLAGS)
+            .filter(user__username='applicant'),
+            [self.profile]
+        )
+
+
+class GenerateQuestionSetTests(AssessmentTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other_topic = QuestionTopic.objects.create(
+            category=cls.category, name='Numerical', questions_per_test=2
+        )
+        cls.other_questions = [
+            Question.objects.create(topic=cls.other_topic, question_text=f'N{i}', correct_answer='a')
+            for i in range(3)
+        ]
+        Question.objects.create(
+            topic=cls.other_topic, question_text='Retired', correct_answer='a', is_active=False
+        )
+
+    def test_samples_every_category_topic(self):
+        question_ids = self.test.generate_question_set()
+        self.assertEqual(len(set(question_ids)), 6)
+        topics = Counter(
+            Question.objects.filter(pk__in=question_ids).values_list('topic_id', flat=True)
+        )
+        self.assertEqual(topics, {self.topic.pk: 4, self.other_topic.pk: 2})
+
+    def test_follows_distributions_in_order(self):
+        TestTopicDistribution.objects.create(
+            test=self.test, topic=self.other_topic, num_questions=10, order=1
+        )
+        TestTopicDistribution.objects.create(
+            test=self.test, topic=self.topic, num_questions=2, order=2
+        )
+        # One query for the distributions, one for all topics' question IDs
+        with self.assertNumQueries(2):
+            question_ids = self.test.generate_question_set()
+
+        # Capped at the three active questions of the first topic
+        self.assertCountEqual(question_ids[:3], [q.pk for q in self.other_questions])
+        self.assertEqual(len(question_ids), 5)
+        self.assertTrue(set(question_ids[3:]) <= {q.pk for q in self.questions})
+
+    def test_bulk_attempts_store_the_generated_ids(self):
+        [attempt] = create_test_attempts_bulk(self.test, [self.user])
+        attempt = TestAttempt.objects.get(pk=attempt.pk)
+        self.assertEqual(len(attempt.question_ids), 6)
+        self.assertTrue(all(isinstance(question_id, int) for question_id in attempt.question_ids))
+        # One blank answer per generated question
+        self.assertCountEqual(
+            attempt.answers.values_list('question_id', flat=True), attempt.question_ids
+        )
+
+
+@mock.patch('assessment.models.LARGE_TOPIC_QUESTION_COUNT', 3)
+class LargeTopicSamplingTests(AssessmentTestCase):
+    def assertValidSample(self, sample, count):
+        self.assertEqual(len(sample), count)
+        self.assertEqual(len(set(sample)), count)
+        self.assertTrue(set(sample) <= {q.pk for q in self.questions})
+
+    def test_large_topic_is_filtered_in_sql(self):
+        # 3 * 2 / 4 rows keeps every row, so the filter always returns enough
+        with mock.patch('assessment.models.reservoir_sample') as sampler:
+            sample = self.topic.sample_question_ids(2)
+        sampler.assert_not_called()
+        self.assertValidSample(sample, 2)
+
+    def test_falls_back_to_reservoir_sampling(self):
+        with mock.patch.dict('assessment.models.RANDOM_FRACTION_SQL', clear=True), \
+                mock.patch('assessment.models.reservoir_sample', wraps=reservoir_sample) as sampler:
+            sample = self.topic.sample_question_ids(3)
+        sampler.assert_called_once()
+        self.assertValidSample(sample, 3)
+
+    def test_small_topic_uses_the_id_list(self):
+        with mock.patch('assessment.models.LARGE_TOPIC_QUESTION_COUNT', 10), \
+                mock.patch('assessment.models.QuestionTopic._sample_large_topic') as large:
+            sample = self.topic.sample_question_ids(2)
+        large.assert_not_called()
+        self.assertValidSample(sample, 2)
+
+
+class HotspotKernelTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.regions = rng.uniform(0, 100, size=(40, 4))
+        self.counts = rng.integers(0, 6, size=200)
+        self.starts = rng.integers(0, 35, size=200)
+        self.cx = rng.uniform(0, 200, size=200)
+        self.cy = rng.uniform(0, 200, size=200)
+        self.cx[:5] = np.nan
+        # Clicks exactly on a region's corners count as hits
+        self.counts[5:7] = 1
+        self.starts[5:7] = 0
+        x, y, w, h = self.regions[0]
+        self.cx[5:7], self.cy[5:7] = (x, x + w), (y, y + h)
+
+    def expected(self):
+        return np.array([
+            any(
+                x <= self.cx[i] <= x + w and y <= self.cy[i] <= y + h
+                for x, y, w, h in self.regions[self.starts[i]:self.starts[i] + self.counts[i]]
+            )
+            for i in range(len(self.cx))
+        ])
+
+    def test_numpy_kernel_matches_a_plain_loop(self):
+        hits = scoring._hotspot_hits_numpy(self.cx, self.cy, self.regions, self.starts, self.counts)
+        np.testing.assert_array_equal(hits, self.expected())
+        self.assertTrue(hits[5:7].all())
+        self.assertFalse(hits[:5].any())
+
+    @skipUnless(scoring.NUMBA_AVAILABLE, 'numba is not installed')
+    def test_numba_kernel_matches_a_plain_loop(self):
+        hits = scoring._hotspot_hits_numba(self.cx, self.cy, self.regions, self.starts, self.counts)
+        np.testing.assert_array_equal(hits, self.expected())
+
+    def test_no_regions_never_hit(self):
+        hits = scoring.hotspot_hits(
+            np.array([1.0]), np.array([1.0]), np.empty((0, 4)),
+            np.array([0]), np.array([0])
+        )
+        self.assertFalse(hits[0])
+
+
+class RecheckHotspotsTests(AssessmentTestCase):
+    def test_bulk_regrade_matches_grade_hotspot(self):
+        rng = random.Random(11)
+        questions = [
+            Question.objects.create(
+                topic=self.topic, question_text=f'Click {i}', question_type='dicom',
+                hotspot_coordinates=[
+                    {'x': rng.randint(0, 80), 'y': rng.randint(0, 80), 'width': 20, 'height': 20}
+                    for _ in range(i)
+                ]
+            )
+            for i in range(4)
+        ]
+        clicks = [{'x': rng.randint(0, 100), 'y': rng.randint(0, 100)} for _ in range(3)] + [None]
+        for question, click in itertools.product(questions, clicks):
+            # Answers are unique per attempt and question
+            attempt = self.make_attempt([])
+            attempt.answers.create(question=question, clicked_coordinates=click)
+
+        answers = Answer.objects.filter(question__question_type='dicom')
+        self.assertEqual(Answer.recheck_hotspots_bulk(Answer.objects.all()), answers.count())
+
+        for answer in answers.select_related('question'):
+            with self.subTest(question=answer.question.question_text, click=answer.clicked_coordinates):
+                self.assertEqual(answer.is_correct, answer._grade_hotspot())
+
+
+class CleanupOldSnapshotsTests(AssessmentTestCase):
+    @mock.patch('assessment.models.CLEANUP_BATCH_SIZE', 2)
+    def test_deletes_old_events_and_images_in_batches(self):
+        attempt = TestAttempt.objects.create(user=self.user, test=self.test)
+        old = timezone.now() - timedelta(days=31)
+        for i in range(5):
+            ProctoringEvent.objects.create(
+                attempt=attempt, event_type='snapshot', timestamp=old,
+                image_file=f'proctoring/old{i}.jpg' if i % 2 else ''
+            )
+        recent = ProctoringEvent.objects.create(
+            attempt=attempt, event_type='snapshot', image_file='proctoring/recent.jpg'
+        )
+
+        storage = ProctoringEvent._meta.get_field('image_file').storage
+        # Batches of 2, 2 and 1 (a SELECT and a DELETE each), then an empty SELECT
+        with mock.patch.object(storage, 'delete') as delete_file, self.assertNumQueries(7):
+            self.assertEqual(ProctoringEvent.cleanup_old_snapshots(days=30), 5)
+
+        self.assertCountEqual(
+            [call.args[0] for call in delete_file.call_args_list],
+            ['proctoring/old1.jpg', 'proctoring/old3.jpg']
+        )
+        self.assertQuerySetEqual(ProctoringEvent.objects.all(), [recent])
+
+
+class SkillGapsTests(AssessmentTestCase):
+    def test_reports_each_topic_in_one_query(self):
+        anatomy = QuestionTopic.objects.create(category=self.category, name='Anatomy')
+        anatomy_question = Question.objects.create(
+            topic=anatomy, question_text='A0', correct_answer='a'
+        )
+        attempt = self.make_attempt(['a', 'a', 'b', None])
+        Answer.objects.create(attempt=attempt, question=anatomy_question, selected_answer='a')
+        Answer.check_answers_bulk(attempt)
+
+        with self.assertNumQueries(1):
+            gaps = attempt.get_skill_gaps()
+
+        self.assertEqual(gaps, [
+            {'topic': 'Anatomy', 'percentage': 100.0, 'correct': 1, 'total': 1, 'is_gap': False},
+            {'topic': 'Verbal', 'percentage': 50.0, 'correct': 2, 'total': 4, 'is_gap': True},
+        ])
@@ -1,8 +1,9 @@
 """
 Utility functions for the assessment app
 """
+from datetime import timedelta
 from django.utils import timezone
-from assessment.models import TestAttempt
+from assessment.models import TestAttempt, Answer
 
 
 def create_test_attempts_bulk(test, users):
@@ -23,13 +24,16 @@ def create_test_attempts_bulk(test, users):
         List of created TestAttempt instances
     """
     attempts = []
+    now = timezone.now()
+    expires_at = now + timedelta(minutes=test.time_limit_minutes)
     for user in users:
         attempt = TestAttempt(
             user=user,
             test=test,
             status='started',
             consent_given=False,
-            started_at=timezone.now()
+            started_at=now,
+            expires_at=expires_at  # bulk_create bypasses save()
         )
         attempts.append(attempt)
     
@@ -39,10 +43,20 @@ def create_test_attempts_bulk(test, users):
     # Generate questions for each attempt
     for attempt in created_attempts:
         if test.auto_generate_from_topics:
-            questions = test.generate_question_set()
-            attempt.question_set = [q.id for q in questions]
+            attempt.question_ids = test.generate_question_set()
     
     # Bulk update
-    TestAttempt.objects.bulk_update(created_attempts, ['question_set'])
+    TestAttempt.objects.bulk_update(created_attempts, ['question_set_packed'])
+    
+    # Blank answers for every attempt in one batched insert
+    Answer.objects.bulk_create(
+        [
+            Answer(attempt=attempt, question_id=question_id)
+            for attempt in created_attempts
+            for question_id in attempt.question_ids or []
+        ],
+        batch_size=500,
+        ignore_conflicts=True
+    )
     
     return created_attempts
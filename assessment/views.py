@@ -14,6 +14,7 @@ from django.contrib.auth.models import User
 from .forms import CandidateRegistrationForm, UserProfileUpdateForm
 
 from .models import Test, TestAttempt, Question, Answer
+from .proctoring_buffer import buffering_enabled, event_buffer
 
 
 def get_profile_completion_data(user):
@@ -27,7 +28,7 @@ def get_profile_completion_data(user):
         profile = user.profile
     except UserProfile.DoesNotExist:
         # Create profile if it doesn't exist
-        profile = UserProfile.objects.create(user=user)
+        profile, _ = UserProfile.objects.get_or_create(user=user)
     
     # Required fields for profile completion
     required_fields = {
@@ -157,7 +158,7 @@ def dashboard(request):
     # Get past test attempts
     past_attempts = TestAttempt.objects.filter(
         user=request.user
-    ).select_related('test').order_by('-started_at')[:5]
+    ).with_display().order_by('-started_at')[:5]
     
     # Get profile completion data
     profile_completion = get_profile_completion_data(request.user)
@@ -205,7 +206,7 @@ def start_test(request, test_id):
         # Check if expired
         if active_attempt.is_expired():
             active_attempt.status = 'expired'
-            active_attempt.save()
+            active_attempt.save(update_fields=['status'])
         else:
             # Continue existing attempt
             return redirect('take_test', attempt_id=active_attempt.id)
@@ -226,33 +227,34 @@ def take_test(request, attempt_id):
     Handle test taking with proctoring - Compatible with Alpine.js template
     """
     attempt = get_object_or_404(TestAttempt, id=attempt_id, user=request.user)
+    now = timezone.now()
     
     # Check if test has expired
-    if attempt.is_expired():
+    if attempt.is_expired(now):
         attempt.status = 'expired'
-        attempt.save()
+        attempt.save(update_fields=['status'])
         messages.error(request, 'This test has expired.')
         return redirect('dashboard')
     
     # Generate question set if not already done
-    if not attempt.question_set:
-        questions = attempt.test.generate_question_set()
-        attempt.question_set = [q.id for q in questions]
+    if not attempt.question_ids:
+        attempt.question_ids = attempt.test.generate_question_set()
         attempt.status = 'in_progress'
-        attempt.save()
+        attempt.save(update_fields=['question_set_packed', 'status'])
+        attempt.create_blank_answers(attempt.question_ids)
     
     # Get ALL questions from stored question_set (for Alpine.js template)
     from assessment.models import Question
-    question_ids = attempt.question_set
-    questions = Question.objects.filter(id__in=question_ids)
+    question_ids = attempt.question_ids
+    questions_by_id = Question.objects.in_bulk(question_ids)
     
     # Preserve order from question_set
-    questions = sorted(questions, key=lambda q: question_ids.index(q.id))
+    questions = [questions_by_id[qid] for qid in question_ids if qid in questions_by_id]
     
     context = {
         'attempt': attempt,
         'questions': questions,  # All questions for Alpine.js
-        'time_remaining': attempt.time_remaining_seconds(),
+        'time_remaining': attempt.time_remaining_seconds(now),
     }
     
     return render(request, 'assessment/take_test.html', context)
@@ -282,7 +284,10 @@ def submit_answer(request, attempt_id):
         answer, created = Answer.objects.update_or_create(
             attempt=attempt,
             question=question,
-            defaults={'clicked_coordinates': {'x': int(clicked_x), 'y': int(clicked_y)}}
+            defaults={
+                'clicked_coordinates': {'x': int(clicked_x), 'y': int(clicked_y)},
+                'answered_at': timezone.now()
+            }
         )
         answer.check_answer()
         return JsonResponse({
@@ -296,7 +301,8 @@ def submit_answer(request, attempt_id):
         attempt=attempt,
         question=question,
         defaults={
-            'selected_answer': selected_answer
+            'selected_answer': selected_answer,
+            'answered_at': timezone.now()
         }
     )
     
@@ -314,12 +320,13 @@ def submit_answer(request, attempt_id):
 def get_time_remaining(request, attempt_id):
     """Get remaining time for test (HTMX endpoint)"""
     attempt = get_object_or_404(TestAttempt, id=attempt_id, user=request.user)
+    now = timezone.now()
     
-    time_remaining = attempt.time_remaining_seconds()
+    time_remaining = attempt.time_remaining_seconds(now)
     
     return JsonResponse({
         'time_remaining': time_remaining,
-        'is_expired': attempt.is_expired()
+        'is_expired': attempt.is_expired(now)
     })
 
 
@@ -345,26 +352,25 @@ def submit_test(request, attempt_id):
         if not disqualification_reason:
             disqualification_reason = 'Fullscreen exit violation'
         
+    # Write any buffered proctoring events before the attempt is closed
+    if buffering_enabled():
+        event_buffer.flush(attempt.id)
+    
     # Calculate time spent
-    time_spent = (timezone.now() - attempt.started_at).total_seconds()
+    now = timezone.now()
+    time_spent = (now - attempt.started_at).total_seconds()
     attempt.time_spent_seconds = int(time_spent)
     
     # Mark as completed
     attempt.status = 'completed'
-    attempt.completed_at = timezone.now()
+    attempt.completed_at = now
     
     # NEW: Handle disqualification
     if is_disqualified:
         # Mark all answers as incorrect (0% score)
-        question_ids = attempt.question_set or []
-        for question_id in question_ids:
-            question = Question.objects.get(id=question_id)
-            # Create Answer object marking as incorrect
-            Answer.objects.update_or_create(
-                attempt=attempt,
-                question=question,
-                defaults={'is_correct': False}  # All answers marked incorrect
-            )
+        question_ids = attempt.question_ids or []
+        attempt.create_blank_answers(question_ids)
+        attempt.answers.filter(question_id__in=question_ids).update(is_correct=False)
         
         # Force score to 0%
         attempt.score = 0.0
@@ -375,30 +381,25 @@ def submit_test(request, attempt_id):
             attempt.metadata = {}
         attempt.metadata['disqualified'] = True
         attempt.metadata['disqualification_reason'] = disqualification_reason
-        attempt.metadata['disqualification_timestamp'] = timezone.now().isoformat()
+        attempt.metadata['disqualification_timestamp'] = now.isoformat()
         
-        attempt.save()
+        attempt.save(update_fields=[
+            'status', 'completed_at', 'time_spent_seconds', 'score', 'passed', 'metadata'
+        ])
         
         messages.error(request, 
             f'⚠️ EXAM DISQUALIFIED: {disqualification_reason}. Your score has been set to 0%.')
         
     else:
         # Normal submission - process answers normally
-        question_ids = attempt.question_set or []
-        for question_id in question_ids:
-            question = Question.objects.get(id=question_id)
-            # Create Answer object if it doesn't exist (for unanswered questions)
-            answer, created = Answer.objects.get_or_create(
-                attempt=attempt,
-                question=question,
-                defaults={'is_correct': False}  # Unanswered = incorrect
-            )
-            # Check answer for all (in case some weren't checked when submitted)
-            if answer.is_correct is None:
-                answer.check_answer()
+        # Blank rows for unanswered questions, graded as incorrect below
+        attempt.create_blank_answers(attempt.question_ids or [])
+        
+        # Check answer for all (in case some weren't checked when submitted)
+        Answer.check_answers_bulk(attempt)
         
         # Calculate score normally
-        attempt.calculate_score()
+        attempt.calculate_score('status', 'completed_at', 'time_spent_seconds')
         
         messages.success(request, 'Test submitted successfully!')
     
@@ -410,8 +411,15 @@ def test_result(request, attempt_id):
     """Display test results"""
     attempt = get_object_or_404(TestAttempt, id=attempt_id, user=request.user)
     
-    # Get all answers with questions
-    answers = attempt.answers.select_related('question').all()
+    # Get all answers with questions (skipping columns the review never shows)
+    answers = attempt.answers.select_related('question').defer(
+        'clicked_coordinates',
+        'uploaded_segmentation',
+        'question__hotspot_coordinates',
+        'question__dicom_series',
+        'question__dicom_file',
+        'question__ground_truth_file',
+    ).order_by('answered_at')
     
     context = {
         'attempt': attempt,
@@ -433,12 +441,12 @@ def dicom_question_view(request, attempt_id, question_id):
     if attempt.is_expired() or attempt.status == 'completed':
         return redirect('test_result', attempt_id=attempt.id)
     
-    # Check if this question is already answered
-    try:
-        answer = Answer.objects.get(attempt=attempt, question=question)
-        already_answered = True
-    except Answer.DoesNotExist:
-        already_answered = False
+    # Check if this question is already answered (blank rows are pre-created)
+    already_answered = Answer.objects.filter(
+        attempt=attempt,
+        question=question,
+        is_correct__isnull=False
+    ).exists()
     
     context = {
         'attempt': attempt,
@@ -491,7 +499,7 @@ def submit_dicom_answer(request, attempt_id):
             'clicked_z': float(clicked_z),
             'clicked_viewport': viewport,
             'is_correct': is_correct,
-            'submitted_at': timezone.now()
+            'answered_at': timezone.now()
         }
     )
     
@@ -26,6 +26,18 @@ app.conf.beat_schedule = {
         'task': 'assessment.tasks.detect_plagiarism',
         'schedule': crontab(hour=3, minute=0),  # 3 AM daily
     },
+    'refresh-test-stats': {
+        'task': 'assessment.tasks.refresh_test_stats',
+        'schedule': crontab(minute='*/5'),  # Every 5 minutes
+    },
+    'flush-proctoring-events': {
+        'task': 'assessment.tasks.flush_proctoring_events',
+        'schedule': 10.0,  # Every 10 seconds
+    },
+    'expire-stale-attempts': {
+        'task': 'assessment.tasks.expire_stale_attempts',
+        'schedule': crontab(minute='*'),  # Every minute
+    },
 }
 
 @app.task(bind=True)
@@ -149,6 +149,18 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Africa/Harare'
 
+# Cache: set CACHE_URL (e.g. the Redis used by Celery) so all workers share
+# one cache. Without it each process gets its own LocMemCache and the
+# question ID cache is bypassed (see assessment.models.question_cache_is_shared)
+CACHE_URL = config('CACHE_URL', default='')
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+
 # Face Verification Settings
 FACE_VERIFICATION_ENABLED = True
 MIN_FACE_CONFIDENCE = 0.85  # 85% confidence that face is detected
@@ -159,7 +171,18 @@ MIN_FACE_SIZE_PIXELS = 100  # Minimum face width/height
 BLOCK_MOBILE_DEVICES = True
 ALLOWED_DEVICES = ['desktop', 'laptop']  # Block 'mobile', 'tablet'
 
+# Scoring Settings
+SCORE_IN_DATABASE = config('SCORE_IN_DATABASE', default=False, cast=bool)  # Use TestAttempt.finalize()
+
 # Proctoring Settings
 PROCTORING_ENABLED = True
 SNAPSHOT_INTERVAL = 180  # 3 minutes
 EVENT_SCREENSHOTS_ENABLED = True
+PROCTORING_EVENT_BUFFERING = config('PROCTORING_EVENT_BUFFERING', default=False, cast=bool)  # Queue events in Redis, bulk insert
+PROCTORING_EVENT_BUFFER_URL = config('PROCTORING_EVENT_BUFFER_URL', default=CELERY_BROKER_URL)
+PROCTORING_EVENT_BUFFER_FLUSH_SIZE = config('PROCTORING_EVENT_BUFFER_FLUSH_SIZE', default=1000, cast=int)  # Queued events per attempt that trigger an early flush
+PROCTORING_ASYNC_SNAPSHOT_COMPRESSION = config('PROCTORING_ASYNC_SNAPSHOT_COMPRESSION', default=False, cast=bool)  # Compress snapshots in Celery
+
+# Plagiarism Detection
+PLAGIARISM_MIN_MATCHES = config('PLAGIARISM_MIN_MATCHES', default=5, cast=int)  # Identical MCQ answers before a pair is compared
+PLAGIARISM_SIMILARITY_THRESHOLD = config('PLAGIARISM_SIMILARITY_THRESHOLD', default=90.0, cast=float)  # Percent